@@ -20,7 +20,7 @@
 
 """Miscellaneous I/O operations."""
 
-__all__ = ['CFreadlines','CFcontours','CFTimeSeries','CFEIStemp','CFEpoch']
+__all__ = ['CFreadlines','CFcolumnwriter','CFcontours','CFTimeSeries','CFEIStemp','CFEpoch']
 
 import numpy, math
 
@@ -43,6 +43,56 @@ def CFreadlines(fobject, comment='#'):
         lines.append(l)
     return lines
 
+class CFcolumnwriter(object):
+    """Buffered writer for columns of numbers.
+
+    Rows are collected as arrays and formatted and written in large blocks."""
+
+    def __init__(self,fobject,fmt='%f',sep='\t',bufsize=10000):
+        """Initialise.
+
+        fobject: file object to be written to
+        fmt: format of a single value
+        sep: column separator
+        bufsize: number of rows buffered before they are written."""
+
+        self.fobject = fobject
+        self.fmt = fmt
+        self.sep = sep
+        self.bufsize = bufsize
+        self.__blocks = []
+        self.__nrows = 0
+
+    def write(self,*columns):
+        """Add rows.
+
+        columns: arrays of column values, all of the same length. Single values are
+                 repeated for all rows."""
+
+        columns = numpy.broadcast_arrays(*[numpy.asarray(c,'d') for c in columns])
+        block = numpy.column_stack([numpy.ravel(c) for c in columns])
+        self.__blocks.append(block)
+        self.__nrows = self.__nrows + len(block)
+        if self.__nrows >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows."""
+
+        for block in self.__blocks:
+            if len(block) == 0:
+                continue
+            line = self.sep.join([self.fmt]*block.shape[1])
+            text = '\n'.join([line%tuple(r) for r in block.tolist()])+'\n'
+            self.fobject.write(text.replace('nan','NaN'))
+        self.__blocks = []
+        self.__nrows = 0
+
+    def close(self):
+        """Write remaining rows, the file object is not closed."""
+
+        self.flush()
+
 class CFcontours(list):
     """Read an ASCII file containing contours and store them in a list."""
 
@@ -27,9 +27,9 @@ to use a different SQL backend if that is needed since the Python DB API 2.0 is
 used.
 """
 
-__all__=['CFRSL']
+__all__=['CFRSL','CFRSLstore']
 
-import sqlite, optparse, sys, numpy, string
+import sqlite, optparse, sys, numpy, string, os.path
 
 sqltables = [
     'CREATE TABLE author ('                         # author table
@@ -91,6 +91,9 @@ class CFRSL(object):
         name: name of database file
         create=False: set to True if you want to create tables, etc"""
 
+        self.name = name
+        # snapshot of the column store
+        self.snapshot = os.path.splitext(name)[0]+'.npz'
         self.db = sqlite.connect(name)
 
         if create:
@@ -102,6 +105,69 @@ class CFRSL(object):
 
         self.__mint = None
         self.__maxt = None
+        self.__store = None
+
+    def __get_store(self):
+        if self.__store is None:
+            self.__store = self.loadStore()
+        return self.__store
+    store = property(__get_store)
+
+    def loadStore(self,snapshot=True):
+        """Load measurement and location tables into a CFRSLstore.
+
+        snapshot: when True, load the store from the snapshot file if it is up-to-date
+                  with the database, otherwise read the tables and save a new snapshot.
+
+        The store is usually accessed through the store attribute which loads it once."""
+
+        stamp = None
+        if os.path.isfile(self.name):
+            s = os.stat(self.name)
+            stamp = numpy.array([s.st_size,s.st_mtime],'d')
+        if snapshot and stamp is not None and os.path.isfile(self.snapshot):
+            try:
+                data = numpy.load(self.snapshot)
+                columns = {}
+                if numpy.all(data['dbstamp'] == stamp):
+                    for c in CFRSLstore.columns:
+                        columns[c] = data[c]
+                data.close()
+                if len(columns) > 0:
+                    return CFRSLstore(columns)
+            except (IOError,OSError,KeyError,ValueError):
+                pass
+
+        cu = self.db.cursor()
+        columns = {}
+        cu.execute('SELECT location_id, data_id, longitude, latitude, num FROM location ORDER BY location_id')
+        rows = numpy.reshape(numpy.array(cu.fetchall(),'d'),(-1,5))
+        for i in range(0,5):
+            columns[CFRSLstore.columns[i]] = rows[:,i]
+        cu.execute('SELECT name FROM location ORDER BY location_id')
+        # names may be NULL, keep a string array so the snapshot loads without pickle
+        columns['name'] = numpy.array([r[0] or '' for r in cu.fetchall()]+[''])[:-1]
+        cu.execute('SELECT location_id, measure_id, time, rsl, time_p, time_m, rsl_p, rsl_m FROM measurement '
+                   'ORDER BY location_id, measure_id')
+        rows = numpy.reshape(numpy.array(cu.fetchall(),'d'),(-1,8))
+        for i in range(0,8):
+            columns[CFRSLstore.columns[i+6]] = rows[:,i]
+        store = CFRSLstore(columns)
+
+        if snapshot and stamp is not None:
+            # the snapshot is only an optimisation, e.g. the directory might not be writable
+            try:
+                store.save(self.snapshot,dbstamp=stamp)
+            except (IOError,OSError,KeyError,ValueError):
+                pass
+        return store
+
+    def __changed(self):
+        """Invalidate cached data after database has been changed."""
+
+        self.__mint = None
+        self.__maxt = None
+        self.__store = None
 
     def addAuthor(self,name,firstname,address):
         """Add an author.
@@ -172,6 +238,7 @@ class CFRSL(object):
         #write data to db
         cu.execute('INSERT INTO location VALUES (%i, %i, %s, %f, %f, 0)',(lid,dataset,name,longitude,latitude))
         self.db.commit()
+        self.__changed()
         return lid
 
     def addMeasurements(self, location, time, rsl, time_error=None, rsl_error=None):
@@ -190,50 +257,85 @@ class CFRSL(object):
         if (location,) not in cu.fetchall():
             raise LookupError, 'Location is not in database'
 
-        # check length of data
-        tel = False
-        rel = False
-        if len(time) != len(rsl):
-            raise ValueError, 'Number of time measures is different from number of rsl measures.'
-        if time_error!=None:
-            if len(time_error) != 2:
-                raise ValueError, 'Need positve and negative error bounds'
-            if type(time_error[0]) in (list, tuple, numpy.ndarray):
-                tel = True
-                if (len(time_error[0]) != len(time) or len(time_error[1]) != len(time)):
-                    raise ValueError, 'Time erros are not the same length as time measures.'
-        if rsl_error!=None:
-            if len(rsl_error) != 2:
-                raise ValueError, 'Need positve and negative error bounds'
-            if type(rsl_error[0]) in (list, tuple, numpy.ndarray):
-                rel = True
-                if (len(rsl_error[0]) != len(rsl) or len(rsl_error[1]) != len(rsl)):
-                    raise ValueError, 'RSL erros are not the same length as rsl measures.'
-             
-        # get max id
-        cu.execute('SELECT measure_id FROM measurement')
-        mid = len(cu.fetchall())
-        for i in range(0,len(time)):
-            cu.execute('INSERT INTO measurement (measure_id, location_id, time, rsl) '
-                       'VALUES (%i, %i, %f, %f)',(mid,location,time[i],rsl[i]))
-            if time_error!=None:
-                if tel:
-                    error = [time_error[0][i],time_error[1][i]]
-                else:
-                    error = time_error
-                cu.execute('UPDATE measurement SET time_p = %f, time_m = %f '
-                           'WHERE measure_id == %i',(error[0],error[1],mid))
-            if rsl_error!=None:
-                if rel:
-                    error = [rsl_error[0][i],rsl_error[1][i]]
-                else:
-                    error = rsl_error
-                cu.execute('UPDATE measurement SET rsl_p = %f, rsl_m = %f '
-                           'WHERE measure_id == %i',(error[0],error[1],mid))
-            mid = mid + 1
+        (sql,rows) = measurement_rows(self.__nextid('measure_id','measurement'),location,time,rsl,time_error,rsl_error)
+        cu.executemany(sql,rows)
         # increase the number of measures associated with location
         cu.execute('UPDATE location SET num = num+%i WHERE location_id == %i',(len(time),location))
         self.db.commit()
+        self.__changed()
+
+    def addLocations(self,dataset,locations,batchsize=10000):
+        """Add a number of locations together with their measurements.
+
+        dataset: id of dataset the locations belong to
+        locations: iterable (e.g. a generator reading a file) of
+                   (name, longitude, latitude, time, rsl, time_error, rsl_error)
+                   where time, rsl, time_error and rsl_error are as in addMeasurements
+        batchsize: number of measurements collected before they are inserted
+
+        Location and measurement ids are assigned once, rows are inserted in batches
+        and everything is committed in a single transaction.
+
+        returns list of new location ids."""
+
+        cu = self.db.cursor()
+        # see if dataset is in database
+        cu.execute('SELECT data_id FROM dataset WHERE data_id == %d',dataset)
+        if (dataset,) not in cu.fetchall():
+            raise LookupError, 'Dataset is not in database'
+
+        lid0 = self.__nextid('location_id','location')
+        lid = lid0
+        mid = self.__nextid('measure_id','measurement')
+        lids = []
+        locrows = []
+        measurements = {}
+        nrows = 0
+        try:
+            for (name,longitude,latitude,time,rsl,time_error,rsl_error) in locations:
+                locrows.append((lid,dataset,name,longitude,latitude))
+                (sql,rows) = measurement_rows(mid,lid,time,rsl,time_error,rsl_error)
+                measurements.setdefault(sql,[]).extend(rows)
+                lids.append(lid)
+                lid = lid + 1
+                mid = mid + len(rows)
+                nrows = nrows + len(rows)
+                if nrows >= batchsize:
+                    self.__insert(cu,locrows,measurements)
+                    locrows = []
+                    measurements = {}
+                    nrows = 0
+            self.__insert(cu,locrows,measurements)
+            # set the number of measures associated with the new locations
+            cu.execute('UPDATE location SET num = (SELECT COUNT(*) FROM measurement '
+                       'WHERE measurement.location_id == location.location_id) WHERE location_id >= %i',lid0)
+        except:
+            self.db.rollback()
+            raise
+        self.db.commit()
+        self.__changed()
+        return lids
+
+    def __insert(self,cu,locrows,measurements):
+        """Insert a batch of locations and measurements."""
+
+        if len(locrows) > 0:
+            cu.executemany('INSERT INTO location VALUES (%i, %i, %s, %f, %f, 0)',locrows)
+        for sql in measurements:
+            cu.executemany(sql,measurements[sql])
+
+    def __nextid(self,column,table):
+        """Get the next free id.
+
+        column: name of id column
+        table: name of table"""
+
+        cu = self.db.cursor()
+        cu.execute('SELECT MAX(%s) FROM %s'%(column,table))
+        maxid = cu.fetchone()[0]
+        if maxid == None:
+            return 0
+        return int(maxid)+1
 
     def getLocationRange(self,longs,lats):
         """Get a range of locations.
@@ -241,13 +343,12 @@ class CFRSL(object):
         longs: [min,max] range of longitudes
         lats: [min,max] range of latitudes.
 
-        returns an array of (id, long, lat, dataset)"""
+        returns a list of (id, dataset, name, long, lat, num)
 
-        cu = self.db.cursor()
-        cu.execute('SELECT * FROM location WHERE longitude BETWEEN %f AND %f AND latitude BETWEEN %f AND %f',
-                   (float(longs[0]),float(longs[1]),float(lats[0]),float(lats[1])))
-        
-        return cu.fetchall()
+        the locations are looked up using the spatial index of the store."""
+
+        store = self.store
+        return [store.location(i) for i in store.locationRange(longs,lats)]
 
     def getDataset(self,did):
         """Get dataset info.
@@ -307,7 +408,216 @@ class CFRSL(object):
         return self.__maxt
     maxt = property(__getRSLmaxT)    
     
+class CFRSLstore(object):
+    """The location and measurement tables held in memory as numpy columns.
+
+    Locations are sorted by location_id, measurements by location_id and measure_id.
+    The measurements of the location in row i of the location columns are found in
+    the measurement columns at offsets[i]:offsets[i+1]. Missing errors are NaN.
+
+    Locations are binned into cells of cellsize by cellsize degrees, which are used
+    for looking up the locations within a longitude/latitude range."""
+
+    # location columns followed by measurement columns
+    columns = ['location_id','data_id','longitude','latitude','num','name',
+               'obs_location','measure_id','time','rsl','time_p','time_m','rsl_p','rsl_m']
+    cellsize = 1.
+
+    def __init__(self,columns):
+        """Initialise.
+
+        columns: dictionary of column arrays, see CFRSLstore.columns"""
+
+        for c in self.columns:
+            if c == 'name':
+                self.name = numpy.asarray(columns[c])
+            else:
+                setattr(self,c,numpy.asarray(columns[c],'d'))
+        self.location_id = self.location_id.astype(int)
+        self.data_id = self.data_id.astype(int)
+        self.num = self.num.astype(int)
+        self.obs_location = self.obs_location.astype(int)
+        self.measure_id = self.measure_id.astype(int)
+        # ignore measurements without location
+        keep = numpy.in1d(self.obs_location,self.location_id)
+        if not numpy.all(keep):
+            for c in self.columns[6:]:
+                setattr(self,c,getattr(self,c)[keep])
+        self.offsets = numpy.append(numpy.searchsorted(self.obs_location,self.location_id),len(self.obs_location))
+
+        # spatial index, locations sorted by cell
+        self.__ny = int(numpy.ceil(180./self.cellsize))+2
+        cells = self.__cells(self.longitude,self.latitude)
+        self.__order = numpy.argsort(cells,kind='mergesort')
+        self.__cellids = cells[self.__order]
+
+    def __cells(self,longitude,latitude):
+        """Get cell ids of positions."""
+
+        ix = numpy.floor(numpy.asarray(longitude,'d')/self.cellsize).astype(int)
+        iy = numpy.floor((numpy.asarray(latitude,'d')+90.)/self.cellsize).astype(int)
+        return ix*self.__ny + numpy.clip(iy,0,self.__ny-1)
+
+    def __len__(self):
+        return len(self.location_id)
+
+    def save(self,fname,**extra):
+        """Save store as compressed numpy archive.
+
+        fname: name of file
+        extra: further arrays to be saved"""
+
+        data = {}
+        for c in self.columns:
+            data[c] = getattr(self,c)
+        data.update(extra)
+        numpy.savez_compressed(fname,**data)
+
+    def index(self,lids):
+        """Get row numbers of locations.
+
+        lids: location id or array of location ids"""
+
+        lids = numpy.asarray(lids)
+        if len(self.location_id) == 0:
+            raise LookupError, 'Location is not in database'
+        i = numpy.minimum(numpy.searchsorted(self.location_id,lids),len(self.location_id)-1)
+        if numpy.any(self.location_id[i] != lids):
+            raise LookupError, 'Location is not in database'
+        return i
+
+    def location(self,i):
+        """Get location info.
+
+        i: row number of location
+
+        returns (id, dataset id, name, longitude, latitude, number of measurements) like
+        a row of the location table."""
+
+        return (int(self.location_id[i]),int(self.data_id[i]),self.name[i],
+                float(self.longitude[i]),float(self.latitude[i]),int(self.num[i]))
+
+    def locationRange(self,longs,lats):
+        """Get locations within a range.
+
+        longs: [min,max] range of longitudes
+        lats: [min,max] range of latitudes.
+
+        returns sorted array of row numbers."""
+
+        if len(self.location_id) == 0 or longs[0] > longs[1] or lats[0] > lats[1]:
+            return numpy.zeros(0,int)
+        c0 = self.__cells(longs[0],lats[0])
+        c1 = self.__cells(longs[1],lats[1])
+        rows = []
+        # each column of cells is a contiguous run of the sorted cell ids
+        for ix in range(c0//self.__ny,c1//self.__ny+1):
+            start = numpy.searchsorted(self.__cellids,ix*self.__ny+c0%self.__ny)
+            stop = numpy.searchsorted(self.__cellids,ix*self.__ny+c1%self.__ny,side='right')
+            rows.append(self.__order[start:stop])
+        rows = numpy.sort(numpy.concatenate(rows))
+        inside = numpy.logical_and(numpy.logical_and(self.longitude[rows]>=longs[0],self.longitude[rows]<=longs[1]),
+                                   numpy.logical_and(self.latitude[rows]>=lats[0],self.latitude[rows]<=lats[1]))
+        return rows[inside]
+
+    def slice(self,lid):
+        """Get slice of measurement columns belonging to a location.
+
+        lid: location id"""
+
+        i = self.index(lid)
+        return slice(self.offsets[i],self.offsets[i+1])
+
+    def select(self,lids):
+        """Select the measurements of a number of locations.
+
+        lids: array of location ids
+
+        returns (obs,rows) where obs are the indices of the measurements and rows the
+        row number of the location of each measurement."""
+
+        rows = self.index(numpy.atleast_1d(lids))
+        start = self.offsets[rows]
+        counts = self.offsets[rows+1]-start
+        rows = numpy.repeat(rows,counts)
+        obs = numpy.arange(numpy.sum(counts)) + numpy.repeat(start-numpy.cumsum(counts)+counts,counts)
+        return (obs,rows)
+
 # some private routines
+def measurement_errors(error,n,name):
+    """Expand error bounds to arrays.
+
+    error: [e+, e-] where e+ and e- are either arrays, etc of length n, or a scalar
+    n: number of measures
+    name: name of measures used in error messages"""
+
+    if len(error) != 2:
+        raise ValueError, 'Need positve and negative error bounds'
+    bounds = []
+    for e in error:
+        e = numpy.asarray(e,'d')
+        if e.ndim == 0:
+            e = numpy.repeat(e,n)
+        elif len(e) != n:
+            raise ValueError, '%s erros are not the same length as %s measures.'%(name.capitalize(),name)
+        bounds.append(e)
+    return bounds
+
+def measurement_rows(mid,location,time,rsl,time_error=None,rsl_error=None):
+    """Build measurement rows for a single location.
+
+    mid: id of first measurement
+    location: id of location
+    time, rsl, time_error, rsl_error: see CFRSL.addMeasurements
+
+    returns (sql,rows) where sql is the INSERT statement and rows the list of parameters."""
+
+    if len(time) != len(rsl):
+        raise ValueError, 'Number of time measures is different from number of rsl measures.'
+    n = len(time)
+    columns = [numpy.arange(mid,mid+n),numpy.repeat(location,n),
+               numpy.asarray(time,'d'),numpy.asarray(rsl,'d')]
+    names = 'measure_id, location_id, time, rsl'
+    fmt = '%i, %i, %f, %f'
+    if time_error!=None:
+        columns.extend(measurement_errors(time_error,n,'time'))
+        names = names + ', time_p, time_m'
+        fmt = fmt + ', %f, %f'
+    if rsl_error!=None:
+        columns.extend(measurement_errors(rsl_error,n,'rsl'))
+        names = names + ', rsl_p, rsl_m'
+        fmt = fmt + ', %f, %f'
+    rows = zip(*[c.tolist() for c in columns])
+    return ('INSERT INTO measurement (%s) VALUES (%s)'%(names,fmt),rows)
+
+def peltier_locations(fname):
+    """Read locations from the Peltier RSL database.
+
+    fname: name of file containing the data
+
+    the file is read line by line, each location is yielded as
+    (name, longitude, latitude, time, rsl, time_error, rsl_error)"""
+
+    df = open(fname)
+    n = -1
+    for l in df:
+        l = l.split()
+        if len(l) == 0:
+            continue
+        if n==-1:
+            num = int(l[3])
+            location = (string.join(l[4:]),float(l[2]),float(l[1]))
+            n = 0
+            data = []
+        else:
+            data.append([float(x) for x in l[:4]])
+            n = n+1
+        if n==num:
+            n=-1
+            data = numpy.reshape(numpy.array(data,'d'),(-1,4))
+            yield location + (-data[:,0],data[:,2],[-data[:,1],data[:,1]],[-data[:,3],data[:,3]])
+    df.close()
+
 def rsl_options():
     """generate options."""
 
@@ -317,6 +627,7 @@ def rsl_options():
     opts.add_option("-a","--author",action="append",metavar="NAME FNAME EMAIL",type="string",nargs=3,help="add a new author, where NAME is the name, FNAME the first name and EMAIL, the email address of the author")
     opts.add_option("-d","--dataset",action="append",metavar="NAME SOURCE AUTHORS",type="string",nargs=3,help="add a new dataset, where NAME is the name and SOURCE is the source of the dataset. AUTHORS is a comma separated list of author ids.")
     opts.add_option("-p","--peltier",metavar="FNAME",type="string",help="add Peltier RSL database (ftp://ftp.ncdc.noaa.gov/pub/data/paleo/paleocean/relative_sea_level/sealevel.dat), FNAME is the name of the file containing the data.")
+    opts.add_option("--batchsize",metavar="N",type="int",default=10000,help="number of measurements inserted at once when importing data (default: 10000)")
     opts.add_option("-o","--observation",metavar="ID",type="int",help="print data associated with location ID")
     
     opts.add_option("--create_db", default=False,action="store_true", help="create and initialise a new database")
@@ -391,31 +702,7 @@ if __name__ == '__main__':
         aid1=rsl.addAuthor("Peltier","W.R.","Department of Physics\nUniversity of Toronto\nToronto, Ontario, Canada")
         aid2=rsl.addAuthor("Tushingham","A.M.","Geodynamics Section\nGeological Survey of Canada\nOttawa, Ontario, Canada")
         did =rsl.addDataset("Relative Sea Level Database","ftp://ftp.ncdc.noaa.gov/pub/data/paleo/paleocean/relative_sea_level/sealevel.dat",[aid1,aid2])
-        df = open(options.peltier)
-        n = -1
-        for l in df.readlines():
-            l = l.split()
-            if n==-1:
-                num = int(l[3])
-                lid = rsl.addLocation(string.join(l[4:]),float(l[2]),float(l[1]),did)
-                n = 0
-                time = []
-                rsl_data = []
-                time_m = []
-                time_p = []
-                rsl_m = []
-                rsl_p = []
-            else:
-                time.append(-float(l[0]))
-                rsl_data.append(float(l[2]))
-                time_m.append(-float(l[1]))
-                time_p.append(float(l[1]))
-                rsl_m.append(-float(l[3]))
-                rsl_p.append(float(l[3]))
-                n = n+1
-                if n==num:
-                    n=-1
-                    rsl.addMeasurements(lid,time,rsl_data,[time_m,time_p],[rsl_m,rsl_p])
+        rsl.addLocations(did,peltier_locations(options.peltier),batchsize=options.batchsize)
 
     rsl.close()
     
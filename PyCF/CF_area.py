@@ -278,20 +278,19 @@ class CFArea(PyGMT.AreaXY):
         returns colourmap file"""
 
         # get data
-        rsldata = rsldb.getLocationRange(self.file.minmax_long,self.file.minmax_lat)
+        store = rsldb.store
+        (rows,xy) = self.file.getRSLlocations(rsldb)
+        # calculate residuals of all locations at once
+        lids = self.file.calc_rslres(rsldb,store.location_id[rows].tolist())
         avgs = []
         mina =  10000.
         maxa = -10000.
-        for loc in rsldata:
-            xyloc = self.file.project([loc[3],loc[4]])
-            if self.file.inside(xyloc):
-                try:
-                    a = self.file.get_rslres(rsldb,loc[0],avg=True)
-                except:
-                    continue
-                if (mina>a): mina = a
-                if (maxa<a): maxa = a
-                avgs.append({'x': loc[3],'y':loc[4], 'a': a})
+        for lid in lids:
+            i = store.index(lid)
+            a = self.file.get_rslres(rsldb,lid,avg=True)
+            if (mina>a): mina = a
+            if (maxa<a): maxa = a
+            avgs.append({'x': store.longitude[i],'y':store.latitude[i], 'a': a})
 
         # plot data
         for a in avgs:
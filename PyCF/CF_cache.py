@@ -0,0 +1,112 @@
+# Copyright 2004, Magnus Hagdorn
+#
+# This file is part of GLIMMER.
+#
+# GLIMMER is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# GLIMMER is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GLIMMER; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Caching arrays."""
+
+__all__ = ['CFcache']
+
+import numpy
+
+class CFcache(object):
+    """A dictionary-like cache of numpy arrays bounded by memory.
+
+    When adding an array would exceed the byte budget the least recently used
+    arrays are evicted. Cached arrays are made read-only since they are shared.
+    Other objects can be cached if they provide their size in an nbytes attribute."""
+
+    def __init__(self,maxbytes=64*1024*1024):
+        """Initialise.
+
+        maxbytes: maximum number of bytes held by the cache, set to 0 to disable caching."""
+
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.__data = {}
+        self.__nbytes = 0
+        self.__tick = 0
+
+    def __get_nbytes(self):
+        return self.__nbytes
+    nbytes = property(__get_nbytes)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __contains__(self,key):
+        return key in self.__data
+
+    def get(self,key,default=None):
+        """Get cached array.
+
+        key: key identifying array
+        default: returned if key is not cached."""
+
+        if key in self.__data:
+            self.hits = self.hits + 1
+            self.__tick = self.__tick + 1
+            entry = self.__data[key]
+            entry[0] = self.__tick
+            return entry[1]
+        self.misses = self.misses + 1
+        return default
+
+    def put(self,key,data):
+        """Add an array to the cache.
+
+        key: key identifying array
+        data: array (or object with an nbytes attribute) to be cached
+
+        returns the (read-only) cached array."""
+
+        if isinstance(data,numpy.ndarray) or not hasattr(data,'nbytes'):
+            data = numpy.asarray(data)
+            data.setflags(write=False)
+        self.remove(key)
+        if data.nbytes > self.maxbytes:
+            return data
+        while self.__nbytes+data.nbytes > self.maxbytes:
+            self.__evict()
+        self.__tick = self.__tick + 1
+        self.__data[key] = [self.__tick,data]
+        self.__nbytes = self.__nbytes + data.nbytes
+        return data
+
+    def remove(self,key):
+        """Remove key from cache.
+
+        key: key identifying array."""
+
+        if key in self.__data:
+            self.__nbytes = self.__nbytes - self.__data[key][1].nbytes
+            del self.__data[key]
+
+    def clear(self):
+        """Empty cache."""
+
+        self.__data = {}
+        self.__nbytes = 0
+
+    def __evict(self):
+        """Remove least recently used array."""
+
+        lru = None
+        for key in self.__data:
+            if lru is None or self.__data[key][0] < self.__data[lru][0]:
+                lru = key
+        self.remove(lru)
@@ -94,8 +94,9 @@ class CFcolourmap(object):
                 
     def __get_cptfile(self):
         if self.__cptf != None:
-            v0 = PyGMT.round_down(min(numpy.ravel(self.var.var)))
-            v1 = PyGMT.round_up(max(numpy.ravel(self.var.var)))
+            (v0,v1) = self.var.minmax()
+            v0 = PyGMT.round_down(v0)
+            v1 = PyGMT.round_up(v1)
             PyGMT.command('makecpt','-Crainbow -T%f/%f/%f > %s'%(v0,v1,(v1-v0)/10.,self.__cptfile))
         return self.__cptfile
     cptfile = property(__get_cptfile)
@@ -101,7 +101,7 @@ class CFdiff_base(PyGMT.AutoXY):
         self.cffile2 = cffile2
 
         # checking if we've got the same times
-        (tarray,t1) = CFchecklist(time,self.cffile1.file.variables['time'])
+        (tarray,t1) = CFchecklist(time,self.cffile1.timeaxis)
         if not tarray:
             raise RuntimeError, 'time must be an array, etc.'
         try:
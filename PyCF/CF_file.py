@@ -18,6 +18,7 @@
 
 __all__ = ['CFfile']
 
+import numpy
 from CF_proj import *
 
 class CFfile(object):
@@ -111,6 +112,23 @@ class CFfile(object):
         else:
             return self.projection.proj4(val,inv=inv)
 
+    def project_points(self,points,inv=False):
+        """Project a number of points at once.
+
+        points: array [2,n] of points
+        inv:    if True do the inverse projection
+
+        returns an array [2,n]"""
+
+        points = numpy.asarray(points,'d')
+        if self.projection == 'lin':
+            return points
+        if inv:
+            data = self.projection.Proj4.gridinv((points[0,:],points[1,:]))
+        else:
+            data = self.projection.Proj4.gridfwd((points[0,:],points[1,:]))
+        return numpy.array(data)
+
     # lower left corner in projected coordinates
     def __get_ll_xy(self):
         return self.__ll_xy
@@ -230,6 +248,18 @@ class CFfile(object):
                   point[1] >= self.file.variables['y1'][0] and point[1] <= self.file.variables['y1'][-1])
         return result
 
+    def inside_points(self, points):
+        """Check which of a number of points are inside data set.
+
+        points: array [2,n] of points
+
+        returns a boolean array [n]"""
+
+        points = numpy.asarray(points)
+        x = self.file.variables['x1']
+        y = self.file.variables['y1']
+        return numpy.logical_and(numpy.logical_and(points[0,:] >= x[0], points[0,:] <= x[-1]),
+                                 numpy.logical_and(points[1,:] >= y[0], points[1,:] <= y[-1]))
 
     def reset_bb(self):
         """Reset bounding box."""
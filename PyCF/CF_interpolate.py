@@ -0,0 +1,267 @@
+# Copyright 2004, Magnus Hagdorn
+#
+# This file is part of GLIMMER.
+#
+# GLIMMER is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# GLIMMER is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GLIMMER; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Interpolating gridded data at arbitrary points.
+
+Interpolation is linear in the data, i.e. the interpolated value at a point is a
+weighted sum of grid nodes. The weights only depend on the grid and the points, so
+they are computed once and then applied to as many fields as required."""
+
+__all__ = ['CFspline1D','CFinterpolator2D','CFspline2D','CFbilinear2D']
+
+import numpy
+
+class CFspline1D(object):
+    """Natural cubic spline weights along a single axis.
+
+    These are the same splines as used by GSL (gsl_interp_cspline) and hence the
+    TwoDspline module."""
+
+    # number of rows of the second derivative matrix computed at once
+    blocksize = 256
+
+    def __init__(self,x):
+        """Initialise.
+
+        x: monotonically increasing node positions."""
+
+        self.x = numpy.asarray(x,'d')
+        n = len(self.x)
+        if n < 2:
+            raise ValueError, 'Need at least two nodes.'
+        self.__h = self.x[1:]-self.x[:-1]
+        # LU factorisation of the symmetric tridiagonal system for the second
+        # derivatives at the interior nodes (natural boundary conditions)
+        if n > 2:
+            h = self.__h
+            self.__off = h[1:-1]
+            self.__diag = 2.*(h[:-1]+h[1:])
+            for i in range(1,n-2):
+                self.__diag[i] = self.__diag[i] - self.__off[i-1]*self.__off[i-1]/self.__diag[i-1]
+
+    def __solve(self,r):
+        """Solve the tridiagonal system.
+
+        r: right hand sides [n-2,m]"""
+
+        r = numpy.array(r,'d')
+        for i in range(1,len(r)):
+            r[i] = r[i] - (self.__off[i-1]/self.__diag[i-1])*r[i-1]
+        r[-1] = r[-1]/self.__diag[-1]
+        for i in range(len(r)-2,-1,-1):
+            r[i] = (r[i]-self.__off[i]*r[i+1])/self.__diag[i]
+        return r
+
+    def __rows(self,k):
+        """Get rows of the matrix mapping data to second derivatives.
+
+        k: array of node indices
+
+        returns array [len(k),len(x)]"""
+
+        n = len(self.x)
+        c = numpy.zeros([len(k),n],'d')
+        inner = numpy.flatnonzero(numpy.logical_and(k>0,k<n-1))
+        if len(inner) > 0:
+            # the system is symmetric, so rows of its inverse are found by solving for unit vectors
+            e = numpy.zeros([n-2,len(inner)],'d')
+            e[k[inner]-1,numpy.arange(len(inner))] = 1.
+            z = numpy.transpose(self.__solve(e))
+            h = self.__h
+            rows = numpy.zeros([len(inner),n],'d')
+            rows[:,:-2] = rows[:,:-2] + z*(6./h[:-1])
+            rows[:,1:-1] = rows[:,1:-1] - z*(6./h[:-1]+6./h[1:])
+            rows[:,2:] = rows[:,2:] + z*(6./h[1:])
+            c[inner] = rows
+        return c
+
+    def __check(self,loc):
+        """Check locations and find their intervals."""
+
+        loc = numpy.asarray(loc,'d')
+        if (loc<self.x[0]).any() or (loc>self.x[-1]).any():
+            raise ValueError, 'Location outside interpolation range.'
+        s = numpy.searchsorted(self.x,loc)
+        k = numpy.clip(s-1,0,len(self.x)-2)
+        h = self.x[k+1]-self.x[k]
+        a = (self.x[k+1]-loc)/h
+        b = (loc-self.x[k])/h
+        return (loc,s,k,h,a,b)
+
+    def weights(self,loc):
+        """Get interpolation weights.
+
+        loc: array of positions
+
+        returns an array [len(loc),len(x)] of weights."""
+
+        (loc,s,k,h,a,b) = self.__check(loc)
+        c = self.__rows(numpy.arange(len(self.x)))
+        w = (a*a*a-a)[:,numpy.newaxis]*c[k,:] + (b*b*b-b)[:,numpy.newaxis]*c[k+1,:]
+        w = w*(h*h/6.)[:,numpy.newaxis]
+        p = numpy.arange(len(loc))
+        w[p,k] = w[p,k] + a
+        w[p,k+1] = w[p,k+1] + b
+        return w
+
+    def stencil(self,loc,halfwidth=10):
+        """Get local interpolation weights.
+
+        loc: array of positions
+        halfwidth: half width of stencil
+
+        returns (index,weights), arrays [len(loc),2*halfwidth] of node indices and their
+        weights. Weights of nodes further away are neglected."""
+
+        (loc,s,k,h,a,b) = self.__check(loc)
+        n = len(self.x)
+        width = min(2*halfwidth,n)
+        start = numpy.clip(s-halfwidth,0,n-width)
+        index = start[:,numpy.newaxis] + numpy.arange(width)[numpy.newaxis,:]
+        # second derivative weights of nodes k and k+1 restricted to the stencil,
+        # only the required rows are computed, a block at a time
+        (rows,inv) = numpy.unique(numpy.concatenate((k,k+1)),return_inverse=True)
+        windex = numpy.concatenate((index,index))
+        c = numpy.zeros(windex.shape,'d')
+        for r0 in range(0,len(rows),self.blocksize):
+            sel = numpy.flatnonzero(numpy.logical_and(inv>=r0,inv<r0+self.blocksize))
+            block = self.__rows(rows[r0:r0+self.blocksize])
+            c[sel] = block[(inv[sel]-r0)[:,numpy.newaxis],windex[sel]]
+        m = len(loc)
+        w = (a*a*a-a)[:,numpy.newaxis]*c[:m] + (b*b*b-b)[:,numpy.newaxis]*c[m:]
+        w = w*(h*h/6.)[:,numpy.newaxis]
+        p = numpy.arange(m)
+        w[p,k-start] = w[p,k-start] + a
+        w[p,k+1-start] = w[p,k+1-start] + b
+        return (index,w)
+
+class CFinterpolator2D(object):
+    """Base class for interpolating 2D fields at a fixed set of points.
+
+    The interpolation operator is stored as a sparse matrix with a fixed number of
+    non-zero entries per point, i.e. for each point the flattened indices of the grid
+    nodes used and their weights. Points outside the grid interpolate to NaN."""
+
+    def __init__(self,x,y,points):
+        """Initialise.
+
+        x: x coordinates of grid
+        y: y coordinates of grid
+        points: array [2,n] or list of [x,y] pairs of points"""
+
+        if isinstance(points,numpy.ndarray):
+            points = numpy.asarray(points,'d')
+            if points.ndim == 2 and points.shape[0] != 2:
+                points = numpy.transpose(points)
+        else:
+            points = numpy.transpose(numpy.asarray(points,'d'))
+        if points.ndim == 1:
+            points = points[:,numpy.newaxis]
+        self.points = points
+        self.shape = (len(x),len(y))
+        (x,y) = (numpy.asarray(x,'d'),numpy.asarray(y,'d'))
+        self.outside = numpy.logical_or(numpy.logical_or(points[0,:]<x[0],points[0,:]>x[-1]),
+                                        numpy.logical_or(points[1,:]<y[0],points[1,:]>y[-1]))
+        # locations used for computing weights
+        self.xloc = numpy.clip(points[0,:],x[0],x[-1])
+        self.yloc = numpy.clip(points[1,:],y[0],y[-1])
+        self.index = None
+        self.weights = None
+
+    def _combine(self,ix,wx,iy,wy):
+        """Set up 2D stencils from the 1D stencils along x and y."""
+
+        n = len(self.points[0,:])
+        self.index = ix[:,:,numpy.newaxis]*self.shape[1] + iy[:,numpy.newaxis,:]
+        self.index = numpy.reshape(self.index,(n,-1))
+        self.weights = wx[:,:,numpy.newaxis]*wy[:,numpy.newaxis,:]
+        self.weights = numpy.reshape(self.weights,(n,-1))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __get_nbytes(self):
+        nbytes = 0
+        for a in [self.points,self.outside,self.xloc,self.yloc,self.index,self.weights]:
+            if a is not None:
+                nbytes = nbytes + a.nbytes
+        return nbytes
+    nbytes = property(__get_nbytes)
+
+    def eval(self,data):
+        """Interpolate data.
+
+        data: array [...,x,y], e.g. a single field or a number of time slices [time,x,y]
+
+        returns array [...,point]"""
+
+        data = numpy.asarray(data)
+        if data.shape[-2:] != self.shape:
+            raise ValueError, 'Data does not match grid.'
+        data = numpy.reshape(data,data.shape[:-2]+(-1,))
+        # accumulate over the stencil, so temporaries are only of size [...,point]
+        values = numpy.zeros(data.shape[:-1]+(len(self.index),),'d')
+        for k in range(0,self.index.shape[1]):
+            values = values + numpy.take(data,self.index[:,k],axis=-1)*self.weights[:,k]
+        if self.outside.any():
+            values[...,self.outside] = numpy.nan
+        return values
+
+class CFspline2D(CFinterpolator2D):
+    """Interpolate 2D fields at a fixed set of points using bicubic splines.
+
+    The spline weights decay rapidly away from a point, so only a local stencil of
+    2*halfwidth by 2*halfwidth nodes is kept for each point. The neglected weights
+    are of the order 0.27**halfwidth."""
+
+    def __init__(self,x,y,points,halfwidth=10):
+        """Initialise.
+
+        x: x coordinates of grid
+        y: y coordinates of grid
+        points: array [2,n] or list of [x,y] pairs of points
+        halfwidth: half width of stencil."""
+
+        CFinterpolator2D.__init__(self,x,y,points)
+        (ix,wx) = CFspline1D(x).stencil(self.xloc,halfwidth)
+        (iy,wy) = CFspline1D(y).stencil(self.yloc,halfwidth)
+        self._combine(ix,wx,iy,wy)
+
+class CFbilinear2D(CFinterpolator2D):
+    """Interpolate 2D fields at a fixed set of points using bilinear interpolation."""
+
+    def __init__(self,x,y,points):
+        """Initialise.
+
+        x: x coordinates of grid
+        y: y coordinates of grid
+        points: array [2,n] or list of [x,y] pairs of points"""
+
+        CFinterpolator2D.__init__(self,x,y,points)
+        (ix,wx) = self.__stencil(numpy.asarray(x,'d'),self.xloc)
+        (iy,wy) = self.__stencil(numpy.asarray(y,'d'),self.yloc)
+        self._combine(ix,wx,iy,wy)
+
+    def __stencil(self,x,loc):
+        """Get stencil indices and weights."""
+
+        k = numpy.clip(numpy.searchsorted(x,loc)-1,0,len(x)-2)
+        b = (loc-x[k])/(x[k+1]-x[k])
+        index = numpy.transpose(numpy.array([k,k+1]))
+        weights = numpy.transpose(numpy.array([1.-b,b]))
+        return (index,weights)
@@ -18,16 +18,17 @@
 
 """Loading CF files."""
 
-__all__=['CFloadfile','CFvariable','CFchecklist']
+__all__=['CFloadfile','CFvariable','CFlazyvar','CFchecklist']
 
-import numpy, PyGMT, Scientific.IO.NetCDF,os
-from pygsl import spline, histogram
+import numpy, PyGMT,os, glob, multiprocessing
 from PyGMT.PyGMTgrid import Grid
 from CF_proj import *
 from CF_colourmap import *
 from CF_file import *
+from CF_netcdf import *
 from CF_createfile import *
-from TwoDspline import TwoDspline
+from CF_cache import *
+from CF_interpolate import *
 
 temperatures = ['btemp','temp']
 
@@ -48,15 +49,23 @@ def CFchecklist(section,variable):
 class CFloadfile(CFfile):
     """Loading a CF netCDF file."""
 
-    def __init__(self,fname):
+    def __init__(self,fname,cachesize=64*1024*1024,backend=None):
         """Initialise.
 
-        fname: name of CF file."""
+        fname: name of CF file, a list of files or a glob pattern (e.g. of a
+               run split over a number of restarts) are concatenated along time.
+        cachesize: maximum number of bytes used for caching 2D slices.
+        backend: netCDF backend, see CFopen."""
 
         CFfile.__init__(self,fname)
 
-        self.file = Scientific.IO.NetCDF.NetCDFFile(self.fname,'r')
+        self.file = CFopen(self.fname,'r',backend=backend)
+        self.__backend = backend
+        # names of the files making up the data set
+        self.__fnames = self.__files()
         self.timescale = 0.001
+        # number of time slices read at once when scanning the file
+        self.blocksize = 100
         # get mapping variable name
         for var in self.file.variables.keys():
             if hasattr(self.file.variables[var],'grid_mapping_name'):
@@ -65,18 +74,41 @@ class CFloadfile(CFfile):
         self.reset_bb()
         # initialising variable dictionary
         self.__vars = {}
-        # RSL residuals
+        # RSL residuals, also cached in a file next to the CF file, set to None to disable
         self.__rslres = {}
+        self.__rslreskey = None
+        self.__rslreskeys = None
+        self.__rslresdb = None
+        self.rslrescache = os.path.splitext(self.__fnames[0])[0]+'.rslres.npz'
+        # projected RSL locations
+        self.__rslloc = None
+        # ice statistics
+        self.__icestats = None
+        self.__icestats_done = None
+        # time axis
+        self.__timeaxis = None
+        # 2D slices shared by all variables
+        self.cache = CFcache(cachesize)
+
+    def __get_timeaxis(self):
+        if self.__timeaxis is None or self.__timeaxis[0] != self.timescale:
+            self.__timeaxis = (self.timescale,numpy.asarray(self.file.variables['time'][:],'d')*self.timescale)
+        return self.__timeaxis[1]
+    timeaxis = property(__get_timeaxis)
+
+    def __get_numt(self):
+        return len(self.timeaxis)
+    numt = property(__get_numt)
 
     def time(self,t):
         """Return selected time value."""
 
-        (isar,sel) = CFchecklist(t,self.file.variables['time'])
+        (isar,sel) = CFchecklist(t,self.timeaxis)
 
         if isar:
-            return self.file.variables['time'][sel[0]:sel[1]+1]*self.timescale
+            return self.timeaxis[sel[0]:sel[1]+1]
         else:
-            return self.file.variables['time'][sel]*self.timescale
+            return self.timeaxis[sel]
 
     def timeslice(self,time,round='n'):
         """Get the time slice.
@@ -86,35 +118,61 @@ class CFloadfile(CFfile):
                'u' round up
                'd' round down"""
 
+        return int(self.timeslices([time],round=round)[0])
+
+    def timeslices(self,times,round='n'):
+        """Get the time slices of a number of times.
+
+        times: array/list of times to look up in ISM file
+        round: 'n' round to nearest
+               'u' round up
+               'd' round down
+
+        returns an array of time slices"""
+
         if round not in ['n','u','d']:
             raise ValueError, "Expected one of 'n', 'u', 'd'"
 
-        t0 = 0
-        t1 = len(self.file.variables['time'][:])-1
-        if time < self.time(t0) or time > self.time(t1):
-            raise ValueError, 'Selected time slice [%f] is outside file %s: [%f, %f]'%(time,self.fname,self.time(t0),self.time(t1))
-        if time == self.time(t0): return t0
-        if time == self.time(t1): return t1
-        # use Newton bisection
-        tmid = int((t1-t0)/2)
-        while tmid > 0:
-            if time < self.time(t0+tmid):
-                t1 = t0+tmid
-            elif time > self.time(t0+tmid):
-                t0 = t0+tmid
-            else:
-                return t0+tmid
-            tmid = int((t1-t0)/2)
+        t = self.timeaxis
+        times = numpy.asarray(times,'d')
+        outside = numpy.logical_or(times<t[0],times>t[-1])
+        if outside.any():
+            raise ValueError, 'Selected time slice [%f] is outside file %s: [%f, %f]'%(times[outside][0],self.fname,t[0],t[-1])
+        t1 = numpy.minimum(numpy.searchsorted(t,times),len(t)-1)
+        t0 = numpy.maximum(t1-1,0)
+        exact = t[t1] == times
         if round == 'u':
             return t1
         elif round == 'd':
-            return t0
+            return numpy.where(exact,t1,t0)
         else:
-            if (time-self.time(t0)) < (self.time(t1) - time):
-                return t0
+            return numpy.where(numpy.logical_or(exact,(times-t[t0]) >= (t[t1]-times)),t1,t0)
+
+    def getslice(self,var,time,level=None):
+        """Get a 2D slice of a variable stored in the file.
+
+        var: name of netCDF variable
+        time: time slice
+        level: horizontal slice, None if variable is 2D
+
+        slices are cached, the returned array is read-only and in file order, i.e. [y,x]."""
+
+        if time < 0:
+            time = time + self.numt
+        if level is not None and level < 0:
+            level = level + self.file.variables[var].shape[1]
+        key = (var,time,level)
+        data = self.cache.get(key)
+        if data is None:
+            if level is None:
+                data = self.file.variables[var][time,:,:]
             else:
-                return t1
-        raise AssertionError, 'Why are we here?'
+                data = self.file.variables[var][time,level,:,:]
+            data = numpy.asarray(data)
+            if not data.dtype.isnative:
+                data = data.astype(data.dtype.newbyteorder('='))
+            data = self.cache.put(key,data)
+        return data
 
     def getvar(self,var):
         """Get a variable from file.
@@ -127,6 +185,107 @@ class CFloadfile(CFfile):
             self.__vars[var] = CFvariable(self,var)
         return self.__vars[var]
 
+    def map_slices(self,function,time=None,workers=None,combine=None,args=()):
+        """Apply a function to a number of time slices using a pool of processes.
+
+        function: called as function(cffile,t,*args) for each time slice t, it has to be
+                  picklable, i.e. defined at the top level of a module
+        time: if None, process all time slices
+              if list/etc of size two, interpret as array selection
+              if single value, process only this time slice
+        workers: number of worker processes, if None use the number of CPUs
+        combine: if not None, combine results using combine(result1,result2)
+        args: extra arguments passed to function
+
+        returns a list of results in order of the time slices or the combined result
+        if combine is set.
+
+        each worker opens its own CFloadfile on the file(s) with the same cache size,
+        block size and time scale, consecutive time slices are handed to the same worker
+        so they can make use of its cache."""
+
+        (tarray,t) = CFchecklist(time,self.timeaxis)
+        if not tarray:
+            return function(self,t,*args)
+        slices = range(t[0],t[1]+1)
+        if combine is not None and len(slices) == 0:
+            raise ValueError, 'No time slices selected'
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1,min(workers,len(slices)))
+        pool = None
+        if workers == 1:
+            results = (function(self,i,*args) for i in slices)
+        else:
+            pool = multiprocessing.Pool(workers,_map_init,(self.fname,self.__backend,self.timescale,
+                                                            self.cache.maxbytes,self.blocksize))
+            chunksize = max(1,len(slices)//(4*workers))
+            results = pool.imap(_map_slice,[(function,i,args) for i in slices],chunksize)
+        try:
+            if combine is None:
+                result = list(results)
+            else:
+                first = True
+                for r in results:
+                    if first:
+                        result = r
+                        first = False
+                    else:
+                        result = combine(result,r)
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+        return result
+
+    def getIceStats(self,time=None):
+        """Get ice volume, ice area and area of basal melting.
+
+        time: if None, return data for all time slices
+              if list/etc of size two, interpret as array selection
+              if single value, get only this time slice
+
+        returns a tuple (volume, area, melt area) of unscaled values.
+
+        ice thickness and basal melt rates are read in blocks of self.blocksize time
+        slices and all three statistics are computed in a single pass. The results are
+        cached, so subsequent calls for the same time slices do not touch the file."""
+
+        (tarray,t) = CFchecklist(time,self.timeaxis)
+        if not tarray:
+            t = [t,t]
+        # negative time slices count from the end, like getslice
+        t = list(t)
+        for i in range(0,2):
+            if t[i] < 0:
+                t[i] = t[i] + self.numt
+        t = [t[0],t[1]+1]
+        if self.__icestats is None:
+            self.__icestats = numpy.zeros([3,self.numt],'d')
+            self.__icestats_done = numpy.zeros([self.numt],numpy.bool_)
+        domelt = 'bmlt' in self.file.variables.keys()
+        for t0 in range(t[0],t[1],self.blocksize):
+            t1 = min(t0+self.blocksize,t[1])
+            if self.__icestats_done[t0:t1].all():
+                continue
+            thk = numpy.asarray(self.file.variables['thk'][t0:t1,:,:])
+            thk = numpy.reshape(thk,(t1-t0,-1))
+            ice = thk>0.
+            self.__icestats[0,t0:t1] = numpy.sum(numpy.where(ice,thk,0.),axis=1,dtype='d')
+            self.__icestats[1,t0:t1] = numpy.sum(ice,axis=1)
+            if domelt:
+                mlt = numpy.asarray(self.file.variables['bmlt'][t0:t1,:,:])
+                self.__icestats[2,t0:t1] = numpy.sum(numpy.reshape(mlt,(t1-t0,-1))>0.,axis=1)
+            else:
+                self.__icestats[2,t0:t1] = numpy.nan
+            self.__icestats_done[t0:t1] = True
+        if tarray:
+            return (self.__icestats[0,t[0]:t[1]],self.__icestats[1,t[0]:t[1]],self.__icestats[2,t[0]:t[1]])
+        return (self.__icestats[0,t[0]],self.__icestats[1,t[0]],self.__icestats[2,t[0]])
+
     def getIceArea(self,time=None,scale=1.):
         """Get area covered by ice.
         
@@ -134,16 +293,12 @@ class CFloadfile(CFfile):
               if list/etc of size two, interpret as array selection
               if single value, get only this time slice"""
 
-        (tarray,t) = CFchecklist(time,self.file.variables['time'])
-        values = []
+        (tarray,t) = CFchecklist(time,self.timeaxis)
         fact = self.deltax*self.deltay*scale
+        area = self.getIceStats(time)[1]*fact
         if tarray:
-            for i in range(t[0],t[1]+1):
-                ih = numpy.where(self.file.variables['thk'][i,:,:]>0.,1,0).flat
-                values.append(sum(ih)*fact)
-            return values
-        ih = numpy.where(self.file.variables['thk'][t,:,:]>0.,1,0).flat
-        return sum(ih)*fact
+            return area.tolist()
+        return area
 
     def getIceVolume(self,time=None,scale=1.):
         """Get ice volume
@@ -152,16 +307,12 @@ class CFloadfile(CFfile):
               if list/etc of size two, interpret as array selection
               if single value, get only this time slice"""
 
-        (tarray,t) = CFchecklist(time,self.file.variables['time'])
-        values = []
+        (tarray,t) = CFchecklist(time,self.timeaxis)
         fact = self.deltax*self.deltay*scale
+        volume = self.getIceStats(time)[0]*fact
         if tarray:
-            for i in range(t[0],t[1]+1):
-                ih = numpy.where(self.file.variables['thk'][i,:,:]>0.,self.file.variables['thk'][i,:,:],0.).flat
-                values.append(sum(ih)*fact)
-            return values
-        ih = self.file.variables['thk'][t,:,:].flat
-        return sum(ih)*fact
+            return volume.tolist()
+        return volume
 
     def getFracMelt(self,time=None,scale=1.):
         """Get fractional area where basal melting occurs.
@@ -170,24 +321,14 @@ class CFloadfile(CFfile):
               if list/etc of size two, interpret as array selection
               if single value, get only this time slice"""
 
-        (tarray,t) = CFchecklist(time,self.file.variables['time'])
-        values = []
-        fact = self.deltax*self.deltay*scale
+        if 'bmlt' not in self.file.variables.keys():
+            raise KeyError, 'Variable not in file'
+        (tarray,t) = CFchecklist(time,self.timeaxis)
+        (volume,area,melt) = self.getIceStats(time)
+        frac = numpy.where(area>0,melt/numpy.maximum(area,1.),0.)
         if tarray:
-            for i in range(t[0],t[1]+1):
-                ih = self.getIceArea(time=i,scale=scale)
-                if ih>0:
-                    mlt = numpy.where(self.file.variables['bmlt'][i,:,:]>0.,1,0).flat
-                    values.append(sum(mlt)*fact/ih)
-                else:
-                    values.append(0.)
-            return values
-        ih = self.getIceArea(time=t,scale=scale)
-        if ih>0:
-            mlt = numpy.where(self.file.variables['bmlt'][t,:,:]>0.,1,0).flat
-            return sum(mlt)*fact/ih
-        else:
-            return 0.
+            return frac.tolist()
+        return float(frac)
 
     def getRSL(self,loc,time,clip=True):
         """Get RSL data.
@@ -199,27 +340,19 @@ class CFloadfile(CFfile):
         clip: if set to true only extract RSL for ice free locations"""
 
         # get times
-        (tarray,t) = CFchecklist(time,self.file.variables['time'])
+        (tarray,t) = CFchecklist(time,self.timeaxis)
         # get location
         xyloc = self.project(loc)
         if not self.inside(xyloc):
             raise RuntimeError, 'Point outside grid'
         data = self.getvar('isobase')
         # extract data
-        values = []
         if tarray:
+            values = data.splines([xyloc],t)[:,0]
             if clip:
-                ih_data = self.getvar('thk')
-                for i in range(t[0],t[1]+1):
-                    ih = ih_data.spline(xyloc,i)
-                    if ih>0.:
-                        values.append('nan')
-                    else:
-                        values.append(data.spline(xyloc,i))
-            else:
-                for i in range(t[0],t[1]+1):
-                    values.append(data.spline(xyloc,i))
-            return values
+                ih = self.getvar('thk').splines([xyloc],t)[:,0]
+                values = numpy.where(ih>0.,numpy.nan,values)
+            return values.tolist()
 
         return data.spline(xyloc,t)
 
@@ -227,7 +360,9 @@ class CFloadfile(CFfile):
         """Get RSL residuals.
 
         rsldb: RSL data base
-        time: time interval to be processed"""
+        time: time interval to be processed
+
+        returns a grid containing the 2D histogram of residuals over time."""
 
         hnx = 50
         hny = 50
@@ -239,69 +374,241 @@ class CFloadfile(CFfile):
             t = [self.timeslice(time[0],'d'),self.timeslice(time[1],'u')]
         times = self.time(t)
         
-        # loop over locations
-        res_times = []
-        residuals = []
-        for loc in rsldb.getLocationRange(self.minmax_long,self.minmax_lat):
-            try:
-                res = self.get_rslres(rsldb,loc[0])
-            except:
-                continue
-            for i in range(0,len(res[0])):
-                res_times.append(res[0][i])
-                residuals.append(res[1][i])
-        # create histogram
-        hist = histogram.histogram2d(hnx,hny)
-        hist.set_ranges_uniform(times[0],times[-1],PyGMT.round_down(min(residuals)),PyGMT.round_up(max(residuals)))
+        # get residuals of all locations
+        (rows,xy) = self.getRSLlocations(rsldb)
+        lids = rsldb.store.location_id[rows].tolist()
+        res = [self.__rslres[lid] for lid in self.calc_rslres(rsldb,lids)]
+        if len(res) == 0:
+            raise RuntimeError, 'No RSL residuals for locations inside file %s'%self.fname
+        res_times = numpy.concatenate([r[0] for r in res])
+        residuals = numpy.concatenate([r[1] for r in res])
 
-        for i in range(0,len(residuals)):
-            hist.increment(res_times[i],residuals[i])
-        # turn into a grid
+        # create histogram
         grid = PyGMT.Grid()
         grid.x_minmax = [times[0],times[-1]]
-        grid.y_minmax = [PyGMT.round_down(min(residuals)),PyGMT.round_up(max(residuals))]
-        grid.data=numpy.zeros([hnx,hny],'f')
-        for j in range(0,hny):
-            for i in range(0,hnx):
-                grid.data[i,j] = hist[i,j]
+        grid.y_minmax = [PyGMT.round_down(numpy.min(residuals)),PyGMT.round_up(numpy.max(residuals))]
+        (hist,xedges,yedges) = numpy.histogram2d(res_times,residuals,bins=[hnx,hny],range=[grid.x_minmax,grid.y_minmax])
+        grid.data = hist.astype('f')
         return grid
 
+    def getRSLlocations(self,rsldb):
+        """Get RSL locations inside the grid.
+
+        rsldb: RSL database
+
+        returns (rows,xy) where rows are the row numbers of the locations in rsldb.store
+        and xy an array [2,n] of their projected coordinates.
+
+        The locations within the longitude/latitude range of the file are projected
+        once, the table of projected coordinates and inside flags is cached."""
+
+        (rows,xy,inside) = self.__rsllocations(rsldb)
+        return (rows[inside],xy[:,inside])
+
+    def __rsllocations(self,rsldb):
+        """Table of projected RSL locations.
+
+        returns (rows,xy,inside) for all locations within the longitude/latitude range."""
+
+        store = rsldb.store
+        key = (list(self.minmax_long),list(self.minmax_lat))
+        if self.__rslloc is None or self.__rslloc[0] is not store or self.__rslloc[1] != key:
+            rows = store.locationRange(self.minmax_long,self.minmax_lat)
+            xy = self.project_points([store.longitude[rows],store.latitude[rows]])
+            self.__rslloc = (store,key,rows,xy,self.inside_points(xy))
+        return self.__rslloc[2:]
+
+    def calc_rslres(self,rsldb,lids):
+        """Calculate RSL residuals of a number of locations.
+
+        rsldb: RSL database
+        lids: list of location ids
+
+        The projected locations are taken from the table cached by getRSLlocations, the
+        isobase is sampled at all locations for the time slices needed and the model RSL
+        is interpolated to all observation times in one go. Locations outside the grid or
+        with observations outside the time range of the file are skipped. The residuals
+        are cached in memory and in the file rslrescache.
+
+        returns list of location ids for which residuals are available."""
+
+        self.__load_rslres(rsldb)
+        store = rsldb.store
+        todo = numpy.array([lid for lid in lids if lid not in self.__rslres],int)
+        computed = len(todo) > 0
+        if len(todo) > 0:
+            rows = store.index(todo)
+            counts = store.offsets[rows+1]-store.offsets[rows]
+            # look up the projected locations, locations outside the longitude/latitude
+            # range of the file are not in the table
+            (lrows,lxy,linside) = self.__rsllocations(rsldb)
+            i = numpy.searchsorted(lrows,rows)
+            good = i < len(lrows)
+            good[good] = lrows[i[good]] == rows[good]
+            good[good] = linside[i[good]]
+            good = numpy.logical_and(good,counts>0)
+            for lid in todo[numpy.logical_not(good)]:
+                self.__rslres[int(lid)] = None
+            (todo,xy,counts) = (todo[good],lxy[:,i[good]],counts[good])
+        if len(todo) > 0:
+            (obs,rows) = store.select(todo)
+            # index of location of each observation
+            loc = numpy.repeat(numpy.arange(len(todo)),counts)
+            times = store.time[obs]*self.timescale
+            t = self.__rslres_window(rsldb)
+            mtimes = self.time(t)
+            # skip locations with observations outside the time range
+            good = numpy.ones(len(todo),bool)
+            good[loc[numpy.logical_or(times<mtimes[0],times>mtimes[-1])]] = False
+            if len(mtimes) < 2:
+                good[:] = False
+            else:
+                (index,weights) = CFspline1D(mtimes).stencil(numpy.clip(times,mtimes[0],mtimes[-1]))
+                # only sample the time slices used by the stencils, reading runs of slices at once
+                slices = numpy.unique(index)
+                points = numpy.transpose(xy).tolist()
+                isobase = numpy.zeros([len(slices),len(todo)],'d')
+                for run in numpy.split(numpy.arange(len(slices)),numpy.flatnonzero(numpy.diff(slices)!=1)+1):
+                    isobase[run] = self.getvar('isobase').splines(points,[t[0]+slices[run[0]],t[0]+slices[run[-1]]])
+                index = numpy.searchsorted(slices,index)
+                residuals = store.rsl[obs]-numpy.sum(isobase[index,loc[:,numpy.newaxis]]*weights,axis=1)
+            start = numpy.cumsum(counts)-counts
+            for i in range(0,len(todo)):
+                if good[i]:
+                    s = slice(start[i],start[i]+counts[i])
+                    self.__rslres[int(todo[i])] = (times[s],residuals[s])
+                else:
+                    self.__rslres[int(todo[i])] = None
+        if computed:
+            self.__save_rslres(rsldb)
+        return [lid for lid in lids if self.__rslres.get(lid) is not None]
+
     def get_rslres(self,rsldb,lid,avg=False):
         """Get RSL residual.
 
         rsldb: RSL database
         lid: location id.
-        avg: set to True to get average"""
-
-        # check if residuals are cached
-        if lid not in self.__rslres:
-            # get coordinates
-            cu = rsldb.db.cursor()
-            cu.execute('SELECT longitude,latitude FROM location WHERE location_id == %i',(lid))
-            loc = cu.fetchone()
-
-            # get data
-            times = []
-            obs = []
-            cu.execute('SELECT time,rsl FROM measurement WHERE location_id == %i',(lid))
-            for o in cu.fetchall():
-                times.append(o[0]*self.timescale)
-                obs.append(o[1])
-            ti = [self.timeslice(min(times)-2.,'d'), self.timeslice(max(times),'u')]
-            ts = spline.cspline(ti[1]-ti[0]+1)
-            ts.init(self.time(ti),self.getRSL(list(loc),ti,clip=False))
-            residuals = []
-            for i in range(0,len(times)):
-                residuals.append(obs[i]-ts.eval(times[i]))
-            self.__rslres[lid] = (times,residuals)
+        avg: set to True to get average
+
+        returns (times,residuals) or the average residual."""
+
+        if lid not in self.calc_rslres(rsldb,[lid]):
+            raise RuntimeError, 'Cannot calculate RSL residuals for location %d'%lid
         if avg:
-            r = 0.
-            if len(self.__rslres[lid][1])>0:
-                r = sum(self.__rslres[lid][1])/float(len(self.__rslres[lid][1]))
-            return r
+            return float(numpy.mean(self.__rslres[lid][1]))
         else:
             return self.__rslres[lid]
 
+    def __files(self):
+        """List of files making up the data set.
+
+        glob patterns are expanded, CFopen opens a pattern matching a single file as
+        a plain file."""
+
+        if hasattr(self.file,'fnames'):
+            return list(self.file.fnames)
+        elif type(self.fname) in (list,tuple):
+            return list(self.fname)
+        elif not os.path.exists(self.fname) and glob.has_magic(self.fname):
+            return glob.glob(self.fname)
+        return [self.fname]
+
+    def __rslres_window(self,rsldb):
+        """Time slices used for interpolating the model RSL in time.
+
+        the window spans all observations of the RSL database (limited to the time
+        range of the file), so residuals of a location do not depend on which other
+        locations are processed."""
+
+        t0 = max(rsldb.mint*self.timescale-2.,self.timeaxis[0])
+        t1 = min(rsldb.maxt*self.timescale,self.timeaxis[-1])
+        return [self.timeslice(t0,'d'),self.timeslice(t1,'u')]
+
+    def __rslres_key(self,rsldb):
+        """Identify model files, RSL database and time window residuals depend on.
+
+        the key is computed once for each RSL database and time scale. It is None if
+        the model or the RSL database are not files, the residuals are then not cached
+        in a file."""
+
+        if self.__rslreskeys is not None and self.__rslreskeys[0] is rsldb and self.__rslreskeys[1] == self.timescale:
+            return self.__rslreskeys[2]
+        key = []
+        for f in self.__fnames+[rsldb.name]:
+            if not os.path.isfile(f):
+                key = None
+                break
+            s = os.stat(f)
+            key.append('%s:%d:%f'%(os.path.abspath(f),s.st_size,s.st_mtime))
+        if key is not None:
+            key.append('window:%d,%d'%tuple(self.__rslres_window(rsldb)))
+            key.append('timescale:%g'%self.timescale)
+            key = ';'.join(key)
+        self.__rslreskeys = (rsldb,self.timescale,key)
+        return key
+
+    def __load_rslres(self,rsldb):
+        """Make sure the cached residuals belong to rsldb.
+
+        the residuals are loaded from the cache file if its key matches."""
+
+        key = self.__rslres_key(rsldb)
+        if rsldb is self.__rslresdb and key == self.__rslreskey:
+            return
+        self.__rslresdb = rsldb
+        self.__rslreskey = key
+        self.__rslres = {}
+        if key is None or self.rslrescache is None or not os.path.isfile(self.rslrescache):
+            return
+        try:
+            data = numpy.load(self.rslrescache)
+            if str(data['key']) == key:
+                (lids,offsets,failed) = (data['lids'],data['offsets'],data['failed'])
+                (times,residuals) = (data['times'],data['residuals'])
+                for i in range(0,len(lids)):
+                    if failed[i]:
+                        self.__rslres[int(lids[i])] = None
+                    else:
+                        s = slice(offsets[i],offsets[i+1])
+                        self.__rslres[int(lids[i])] = (times[s],residuals[s])
+            data.close()
+        except (IOError,OSError,KeyError,ValueError):
+            self.__rslres = {}
+
+    def __save_rslres(self,rsldb):
+        """Write residuals to cache file.
+
+        the cache is only written if the model and the RSL database are files."""
+
+        if self.__rslreskey is None or self.rslrescache is None:
+            return
+        lids = sorted(self.__rslres.keys())
+        failed = numpy.zeros(len(lids),bool)
+        averages = numpy.zeros(len(lids),'d')
+        counts = numpy.zeros(len(lids),int)
+        times = [numpy.zeros(0,'d')]
+        residuals = [numpy.zeros(0,'d')]
+        for i in range(0,len(lids)):
+            res = self.__rslres[lids[i]]
+            if res is None:
+                failed[i] = True
+                averages[i] = numpy.nan
+            else:
+                counts[i] = len(res[0])
+                averages[i] = numpy.mean(res[1])
+                times.append(res[0])
+                residuals.append(res[1])
+        # write to temporary file first so other processes never see partial files
+        tmpname = '%s.%d.npz'%(os.path.splitext(self.rslrescache)[0],os.getpid())
+        try:
+            numpy.savez(tmpname,key=numpy.array(self.__rslreskey),lids=numpy.array(lids,int),
+                        offsets=numpy.concatenate(([0],numpy.cumsum(counts))),failed=failed,averages=averages,
+                        times=numpy.concatenate(times),residuals=numpy.concatenate(residuals))
+            os.rename(tmpname,self.rslrescache)
+        except (IOError,OSError,KeyError,ValueError):
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
     def clone(self,fname):
         """Clone self.
 
@@ -327,6 +634,23 @@ class CFloadfile(CFfile):
 
         return newcf
               
+# CF file opened by worker processes of CFloadfile.map_slices
+_map_file = None
+
+def _map_init(fname,backend,timescale,cachesize,blocksize):
+    """Open CF file in worker process."""
+
+    global _map_file
+    _map_file = CFloadfile(fname,cachesize=cachesize,backend=backend)
+    _map_file.timescale = timescale
+    _map_file.blocksize = blocksize
+
+def _map_slice(job):
+    """Process a single time slice in worker process."""
+
+    (function,t,args) = job
+    return function(_map_file,t,*args)
+
 class CFvariable(object):
     """Handling CF variables."""
 
@@ -370,6 +694,8 @@ class CFvariable(object):
         self.__colourmap = CFcolourmap(self)
         self.pmt = False
         self.__varcache = None
+        # spline interpolators, bounded by memory
+        self.__interpolators = CFcache(16*1024*1024)
 
     def __get_units(self):
         try:
@@ -488,44 +814,32 @@ class CFvariable(object):
     colourmap = property(__get_colourmap,__set_colourmap)
 
     def __get_var(self):
-        if self.name=='is':
-            if self.__varcache == None:
-                self.__varcache = self.file.variables['topg'][:,:,:]+self.file.variables['thk'][:,:,:]
-            return self.__varcache
-
-        elif self.name == 'pmp':
-            if self.__varcache == None:
-                ih = numpy.transpose(self.file.variables['thk'][time,:,:])
-                self.__varcache = calc_pmp(ih)
-            return self.__varcache
+        if self.__varcache is None:
+            if self.name == 'is':
+                self.__varcache = CFlazyvar(self.file,['topg','thk'],numpy.add)
+            elif self.name == 'isobase':
+                self.__varcache = CFlazyvar(self.file,['slc'])
+            elif self.name == 'pmp':
+                self.__varcache = CFlazyvar(self.file,['thk'],calc_pmp)
+            elif self.name == 'vel':
+                self.__varcache = CFlazyvar(self.file,['uvel','vvel'],calc_magnitude)
+            elif self.name == 'bvel':
+                self.__varcache = CFlazyvar(self.file,['ubas','vbas'],calc_magnitude)
+            elif self.name == 'bvel_tavg':
+                self.__varcache = CFlazyvar(self.file,['ubas_tavg','vbas_tavg'],calc_magnitude)
+            elif self.name == 'tau':
+                self.__varcache = CFlazyvar(self.file,['taux','tauy'],calc_magnitude)
+            else:
+                return self.file.variables[self.name]
+        return self.__varcache
+    var = property(__get_var)
 
-        elif self.name == 'vel':
-            if self.__varcache == None:
-                self.__varcache = numpy.sqrt(self.file.variables['uvel'][:,:,:,:]*self.file.variables['uvel'][:,:,:,:] +
-                                               self.file.variables['vvel'][:,:,:,:]*self.file.variables['vvel'][:,:,:,:])
-            return self.__varcache
+    def minmax(self):
+        """Get minimum and maximum of the variable.
 
-        elif self.name == 'bvel':
-            if self.__varcache == None:
-                self.__varcache = numpy.sqrt(self.file.variables['ubas'][:,:,:]*self.file.variables['ubas'][:,:,:]+
-                                               self.file.variables['vbas'][:,:,:]*self.file.variables['vbas'][:,:,:])
-            return self.__varcache
+        the variable is processed in chunks of time slices."""
 
-        elif self.name == 'bvel_tavg':
-            if self.__varcache == None:
-                self.__varcache = numpy.sqrt(self.file.variables['ubas_tavg'][:,:,:]*self.file.variables['ubas_tavg'][:,:,:]+
-                                               self.file.variables['vbas_tavg'][:,:,:]*self.file.variables['vbas_tavg'][:,:,:])
-            return self.__varcache
-
-        elif self.name == 'tau':
-            if self.__varcache == None:
-                self.__varcache = numpy.sqrt(self.file.variables['taux'][:,:,:]*self.file.variables['taux'][:,:,:]+
-                                               self.file.variables['tauy'][:,:,:]*self.file.variables['tauy'][:,:,:])
-            return self.__varcache
-        
-        else:
-            return self.file.variables[self.name]
-    var = property(__get_var)
+        return self.__lazyvar().minmax()
 
     def __get_isvelogrid(self):
         return self.xdimension=='x0'
@@ -539,22 +853,179 @@ class CFvariable(object):
         velogrid: set to true to interpolate onto velocity grid."""
 
         if self.average:
-            if not self.is3d:
-                raise RuntimeError, 'Variable %s is not 3D.'%self.name
-            # integrate
-            grid = numpy.zeros((len(self.xdim),len(self.ydim)),'f')
-
-            sigma = self.file.variables['level']
-            sliceup = self.__get2Dfield(time,level=-1,velogrid=velogrid)
-            for k in range(len(sigma)-2,-1,-1):
-                g_slice = self.__get2Dfield(time,level=k,velogrid=velogrid)
-                grid = grid+(sliceup+g_slice)*(sigma[k+1]-sigma[k])
-                sliceup = self.__get2Dfield(time,level=k,velogrid=velogrid)
-            grid = 0.5*grid
+            if time < 0:
+                time = time + self.cffile.numt
+            grid = self.__get_average(time,time+1,velogrid=velogrid)[0]
         else:
             grid = self.__get2Dfield(time,level=level,velogrid=velogrid)
 
         return grid
+
+    def get2Dfields(self,time=None,level=0,velogrid=False,step=1):
+        """Get 2D fields for a range of time slices.
+
+        time: if None, return data for all time slices
+              if list/etc of size two, interpret as array selection
+        level: horizontal slice
+        velogrid: set to true to interpolate onto velocity grid.
+        step: only get every step time slice
+
+        returns a 3D array [time,x,y]
+
+        the time slices are read in chunked hyperslabs."""
+
+        (tarray,t) = CFchecklist(time,self.cffile.timeaxis)
+        if not tarray:
+            t = [t,t]
+        t = [t[0],t[1]]
+        for i in range(2):
+            if t[i] < 0:
+                t[i] = t[i] + self.cffile.numt
+        blocklen = self.__lazyvar().blocklen()
+        fields = []
+        for t0 in range(t[0],t[1]+1,blocklen*step):
+            t1 = min(t0+blocklen*step,t[1]+1)
+            if self.average:
+                fields.append(self.__get_average(t0,t1,velogrid=velogrid,step=step))
+            else:
+                fields.append(self.__get_fields(t0,t1,level=level,velogrid=velogrid,step=step))
+        return numpy.concatenate(fields)
+
+    def get3Dfield(self,time,velogrid=False):
+        """Get all levels of a 3D field.
+
+        time: time slice
+        velogrid: set to true to interpolate onto velocity grid.
+
+        returns a 3D array [level,x,y]"""
+
+        if time < 0:
+            time = time + self.cffile.numt
+        return self.__get_3Dfields(time,time+1,velogrid=velogrid)[0]
+
+    def get3Dfields(self,time=None,velogrid=False,step=1):
+        """Get all levels of 3D fields for a range of time slices.
+
+        time: if None, return data for all time slices
+              if list/etc of size two, interpret as array selection
+        velogrid: set to true to interpolate onto velocity grid.
+        step: only get every step time slice
+
+        returns a 4D array [time,level,x,y]"""
+
+        (tarray,t) = CFchecklist(time,self.cffile.timeaxis)
+        if not tarray:
+            t = [t,t]
+        t = [t[0],t[1]]
+        for i in range(2):
+            if t[i] < 0:
+                t[i] = t[i] + self.cffile.numt
+        return self.__get_3Dfields(t[0],t[1]+1,velogrid=velogrid,step=step)
+
+    def __get_3Dfields(self,t0,t1,velogrid=False,step=1):
+        """Read all levels of time slices t0 to t1-1 in a single hyperslab.
+
+        velogrid: set to true to interpolate onto velocity grid.
+        step: only get every step time slice
+
+        returns a 4D array [time,level,x,y]"""
+
+        if not self.is3d:
+            raise RuntimeError, 'Variable %s is not 3D.'%self.name
+        # read all levels at once, data is in file order [time,level,y,x]
+        grid = numpy.transpose(numpy.asarray(self.var[t0:t1:step],'d'),(0,1,3,2))
+        # correct temperature
+        if self.name in temperatures:
+            if self.pmt:
+                if 'thk' not in self.file.variables.keys():
+                    print 'Warning, cannot correct for pmt because ice thicknesses are not in file'
+                else:
+                    ih = numpy.transpose(numpy.asarray(self.file.variables['thk'][t0:t1:step,:,:],'d'),(0,2,1))
+                    sigma = numpy.asarray(self.file.variables['level'][:],'d')
+                    grid = grid - calc_pmp(ih[:,numpy.newaxis,:,:],sigma[numpy.newaxis,:,numpy.newaxis,numpy.newaxis])
+        grid = grid.astype('f')
+        if velogrid:
+            if not self.isvelogrid:
+                grid = calc_velogrid(grid)
+        return grid
+
+    def __lazyvar(self):
+        """Get variable wrapped as CFlazyvar."""
+
+        var = self.var
+        if not isinstance(var,CFlazyvar):
+            var = CFlazyvar(self.file,[self.name])
+        return var
+
+    def __get_fields(self,t0,t1,level=0,velogrid=False,step=1):
+        """Read 2D fields of time slices t0 to t1-1 in a single hyperslab.
+
+        level: horizontal slice
+        velogrid: set to true to interpolate onto velocity grid.
+        step: only get every step time slice
+
+        returns a 3D array [time,x,y]"""
+
+        t = slice(t0,t1,step)
+        # data is in file order [time,y,x]
+        if self.is3d:
+            grid = numpy.asarray(self.__lazyvar()[t,level,:,:])
+        else:
+            grid = numpy.asarray(self.__lazyvar()[t,:,:])
+        grid = numpy.transpose(grid,(0,2,1))
+        if self.name in ['topg','is']:
+            if 'eus' in self.file.variables.keys():
+                grid = grid - numpy.asarray(self.file.variables['eus'][t])[:,numpy.newaxis,numpy.newaxis]
+        if self.name=='isobase':
+            if 'eus' in self.file.variables.keys():
+                grid = grid + numpy.asarray(self.file.variables['eus'][t])[:,numpy.newaxis,numpy.newaxis]
+        # correct temperature
+        if self.name in temperatures:
+            if self.pmt:
+                if 'thk' not in self.file.variables.keys():
+                    print 'Warning, cannot correct for pmt because ice thicknesses are not in file'
+                else:
+                    ih = numpy.transpose(numpy.asarray(self.file.variables['thk'][t,:,:]),(0,2,1))
+                    if self.name == 'btemp':
+                        fact = 1.
+                    else:
+                        fact = self.file.variables['level'][level]
+                    grid = grid - calc_pmp(ih,fact)
+
+        if velogrid:
+            if not self.isvelogrid:
+                grid = calc_velogrid(grid)
+        return grid
+
+    def __get_average(self,t0,t1,velogrid=False,step=1):
+        """Vertically average time slices t0 to t1-1.
+
+        velogrid: set to true to interpolate onto velocity grid.
+        step: only average every step time slice
+
+        returns a 3D array [time,x,y]"""
+
+        if not self.is3d:
+            raise RuntimeError, 'Variable %s is not 3D.'%self.name
+
+        sigma = numpy.asarray(self.file.variables['level'][:],'d')
+        # read all levels at once, data is in file order [time,level,y,x]
+        data = numpy.asarray(self.var[t0:t1:step],'d')
+        # correct temperature
+        if self.name in temperatures:
+            if self.pmt:
+                if 'thk' not in self.file.variables.keys():
+                    print 'Warning, cannot correct for pmt because ice thicknesses are not in file'
+                else:
+                    ih = numpy.asarray(self.file.variables['thk'][t0:t1:step,:,:],'d')
+                    data = data - calc_pmp(ih[:,numpy.newaxis,:,:],sigma[numpy.newaxis,:,numpy.newaxis,numpy.newaxis])
+        # integrate using the trapezoidal rule
+        grid = numpy.tensordot(data,calc_trapezoid(sigma),axes=([1],[0]))
+        grid = numpy.transpose(grid,(0,2,1)).astype('f')
+        if velogrid:
+            if not self.isvelogrid:
+                grid = calc_velogrid(grid)
+        return grid
     
     def __get2Dfield(self,time,level=0,velogrid=False):
         """Get a 2D field.
@@ -563,35 +1034,36 @@ class CFvariable(object):
         level: horizontal slice
         velogrid: set to true to interpolate onto velocity grid."""
 
+        getslice = self.cffile.getslice
         if self.is3d:
             if self.name == 'vel':
-                grid = numpy.transpose(numpy.sqrt(
-                    self.file.variables['uvel'][time,level,:,:]*self.file.variables['uvel'][time,level,:,:]+
-                    self.file.variables['vvel'][time,level,:,:]*self.file.variables['vvel'][time,level,:,:]))
+                u = getslice('uvel',time,level)
+                v = getslice('vvel',time,level)
+                grid = numpy.transpose(numpy.sqrt(u*u+v*v))
             else:
-                grid = numpy.transpose(self.file.variables[self.name][time,level,:,:])
+                grid = numpy.array(numpy.transpose(getslice(self.name,time,level)))
         else:
             if self.name == 'is':
-                grid = numpy.transpose(self.file.variables['topg'][time,:,:] + self.file.variables['thk'][time,:,:])
+                grid = numpy.transpose(getslice('topg',time) + getslice('thk',time))
             elif self.name=='isobase':
-                grid = numpy.transpose(self.file.variables['slc'][time,:,:])
+                grid = numpy.array(numpy.transpose(getslice('slc',time)))
             elif self.name == 'pmp':
-                ih = numpy.transpose(self.file.variables['thk'][time,:,:])
+                ih = numpy.transpose(getslice('thk',time))
                 grid = numpy.transpose(calc_pmp(ih))
             elif self.name == 'bvel':
-                grid = numpy.transpose(numpy.sqrt(
-                    self.file.variables['ubas'][time,:,:]*self.file.variables['ubas'][time,:,:]+
-                    self.file.variables['vbas'][time,:,:]*self.file.variables['vbas'][time,:,:]))
+                u = getslice('ubas',time)
+                v = getslice('vbas',time)
+                grid = numpy.transpose(numpy.sqrt(u*u+v*v))
             elif self.name == 'bvel_tavg':
-                grid = numpy.transpose(numpy.sqrt(
-                    self.file.variables['ubas_tavg'][time,:,:]*self.file.variables['ubas_tavg'][time,:,:]+
-                    self.file.variables['vbas_tavg'][time,:,:]*self.file.variables['vbas_tavg'][time,:,:]))
+                u = getslice('ubas_tavg',time)
+                v = getslice('vbas_tavg',time)
+                grid = numpy.transpose(numpy.sqrt(u*u+v*v))
             elif self.name == 'tau':
-                grid = numpy.transpose(numpy.sqrt(
-                    self.file.variables['taux'][time,:,:]*self.file.variables['taux'][time,:,:]+
-                    self.file.variables['tauy'][time,:,:]*self.file.variables['tauy'][time,:,:]))
+                u = getslice('taux',time)
+                v = getslice('tauy',time)
+                grid = numpy.transpose(numpy.sqrt(u*u+v*v))
             else:
-                grid = numpy.transpose(self.file.variables[self.name][time,:,:])
+                grid = numpy.array(numpy.transpose(getslice(self.name,time)))
         if self.name in ['topg','is']:
             if 'eus' in self.file.variables.keys():
                 grid = grid - self.file.variables['eus'][time]
@@ -604,7 +1076,7 @@ class CFvariable(object):
                 if 'thk' not in self.file.variables.keys():
                     print 'Warning, cannot correct for pmt because ice thicknesses are not in file'
                 else:
-                    ih = numpy.transpose(self.file.variables['thk'][time,:,:])
+                    ih = numpy.transpose(self.cffile.getslice('thk',time))
                     if self.name == 'btemp':
                         fact = 1.
                     else:
@@ -613,8 +1085,7 @@ class CFvariable(object):
 
         if velogrid:
             if not self.isvelogrid:
-                g_inter = 0.25*(grid[:-1,:-1]+grid[1:,1:]+grid[:-1,1:]+grid[1:,:-1])
-                grid = g_inter
+                grid = calc_velogrid(grid)
         return grid
 
     def spline(self,pos,time,level=0):
@@ -624,12 +1095,42 @@ class CFvariable(object):
         time: time slice
         level: horizontal slice."""
 
-        data = self.get2Dfield(time,level=level)
-        loc = numpy.zeros((2,1),'f')
-        loc[0,0] = pos[0]
-        loc[1,0] = pos[1]
-        res = TwoDspline(self.xdim[:],self.ydim[:],data,loc)
-        return res[0] 
+        return self.splines([pos],time,level=level)[0]
+
+    def splines(self,points,time=None,level=0):
+        """Interpolate 2D fields at a number of points using cubic splines.
+
+        points: list of [xloc,yloc]
+        time: if None, return data for all time slices
+              if list/etc of size two, interpret as array selection
+              if single value, get only this time slice
+        level: horizontal slice.
+
+        returns an array [time,point] or [point] if time is a single value."""
+
+        interpolator = self.interpolator(points)
+        (tarray,t) = CFchecklist(time,self.cffile.timeaxis)
+        if not tarray:
+            return interpolator.eval(self.get2Dfield(t,level=level))
+        values = []
+        for t0 in range(t[0],t[1]+1,self.cffile.blocksize):
+            t1 = min(t0+self.cffile.blocksize-1,t[1])
+            values.append(interpolator.eval(self.get2Dfields([t0,t1],level=level)))
+        return numpy.concatenate(values)
+
+    def interpolator(self,points):
+        """Get spline interpolator for points.
+
+        points: list of [xloc,yloc]
+
+        this method caches the interpolators, the least recently used ones are
+        discarded."""
+
+        key = tuple([(float(p[0]),float(p[1])) for p in points])
+        interp = self.__interpolators.get(key)
+        if interp is None:
+            interp = self.__interpolators.put(key,CFspline2D(self.xdim[:],self.ydim[:],points))
+        return interp
 
     def getGMTgrid(self,time,level=0,velogrid=False):
         """Get a GMT grid.
@@ -650,7 +1151,7 @@ class CFvariable(object):
             grid.x_minmax = [self.xdim[0],self.xdim[-1]]
             grid.y_minmax = [self.ydim[0],self.ydim[-1]]
     
-        if (time >= len(self.file.variables['time'][:])):
+        if (time >= self.cffile.numt):
             raise ValueError, 'ISM file does not contain time slice %d' % time
 
         grid.data = self.get2Dfield(time,level,velogrid=velogrid)
@@ -665,33 +1166,203 @@ class CFvariable(object):
               if list/etc of size two, interpret as array selection
               if single value, get only this time slice
         level: if None get data for all levels (time must be a single value)
-               otherwise get a specific level"""
+               otherwise get a specific level
 
-        if node[0] < 0 or node[0] >= len(self.xdim) or node[1] < 0 or node[1] >= len(self.ydim):
-            raise RuntimeError, 'node is outside bounds'
+        for vertically averaged variables the average is repeated for each level
+        selected."""
 
-        (tarray,t) = CFchecklist(time,self.file.variables['time'])
-        (larray,l) = CFchecklist(level,self.file.variables['level'])
+        values = self.getSpotsIJ([node],time=time,level=level)[0]
+        if numpy.ndim(values) > 0:
+            return values.tolist()
+        return values
 
-        if 'level' not in self.file.variables[self.name].dimensions:
+    def getSpotsIJ(self,nodes,time=None,level=0):
+        """Get data at a number of grid nodes.
+
+        nodes: list of nodes, each a list/tuple/array of size 2
+        time: if None, return data for all time slices
+              if list/etc of size two, interpret as array selection
+              if single value, get only this time slice
+        level: if None get data for all levels (time must be a single value)
+               otherwise get a specific level
+
+        returns an array, the first dimension selects the node. For vertically averaged
+        variables the average is repeated for each level selected.
+
+        the data for each node is read from the file in a single hyperslab."""
+
+        for node in nodes:
+            if node[0] < 0 or node[0] >= len(self.xdim) or node[1] < 0 or node[1] >= len(self.ydim):
+                raise RuntimeError, 'node is outside bounds'
+
+        (tarray,t) = CFchecklist(time,self.cffile.timeaxis)
+        if self.is3d:
+            (larray,l) = CFchecklist(level,self.file.variables[self.var.dimensions[1]])
+        else:
             larray = False
             l = 0
 
         if larray and tarray:
             raise RuntimeError, 'Cannot select both multiple times and vertical slices'
 
-        values = []
         if tarray:
-            for i in range(t[0],t[1]+1):
-                values.append(self.get2Dfield(i,l)[node[0],node[1]])
-            return values
+            t = slice(t[0],t[1]+1)
         if larray:
-            for i in range(l[0],l[1]+1):
-                values.append(self.get2Dfield(t,i)[node[0],node[1]])
-            return values
+            l = slice(l[0],l[1]+1)
+
+        values = []
+        for node in nodes:
+            values.append(self.__get_spot(node,t,l))
+        values = numpy.array(values)
+        if larray and self.average:
+            values = numpy.repeat(values[:,numpy.newaxis],len(range(l.start,l.stop)),axis=1)
+        return values
+
+    def __get_spot(self,node,t,l):
+        """Get data at a single node.
 
-        return self.get2Dfield(t,l)[node[0],node[1]]
+        node: list/tuple/array of size 2 selecting node
+        t: time slice or slice object selecting time slices
+        l: level or slice object selecting levels, ignored if variable is 2D"""
+
+        var = self.__lazyvar()
+        (i,j) = (node[0],node[1])
+        if self.average:
+            l = slice(None)
+        if self.is3d:
+            data = numpy.asarray(var[t,l,j,i],'d')
+        else:
+            data = numpy.asarray(var[t,j,i],'d')
+        if self.name in ['topg','is']:
+            if 'eus' in self.file.variables.keys():
+                data = data - numpy.asarray(self.file.variables['eus'][t],'d')
+        if self.name=='isobase':
+            if 'eus' in self.file.variables.keys():
+                data = data + numpy.asarray(self.file.variables['eus'][t],'d')
+        # correct temperature
+        if self.name in temperatures:
+            if self.pmt:
+                if 'thk' not in self.file.variables.keys():
+                    print 'Warning, cannot correct for pmt because ice thicknesses are not in file'
+                else:
+                    ih = numpy.asarray(self.file.variables['thk'][t,j,i],'d')
+                    if self.name == 'btemp':
+                        fact = 1.
+                    else:
+                        fact = numpy.asarray(self.file.variables['level'][:],'d')[l]
+                    if isinstance(t,slice) and numpy.ndim(fact) > 0:
+                        ih = ih[:,numpy.newaxis]
+                    data = data - calc_pmp(ih,fact)
+        if self.average:
+            data = numpy.dot(data,calc_trapezoid(numpy.asarray(self.file.variables['level'][:],'d')))
+        return data
         
+class CFlazyvar(object):
+    """Lazily evaluated variable derived from netCDF variables.
+
+    Behaves like a (read-only) netCDF variable, data is only computed for the
+    hyperslab requested."""
+
+    def __init__(self,ncfile,components,function=None):
+        """Initialise.
+
+        ncfile: netCDF file
+        components: list of names of netCDF variables the variable is derived from
+        function: function called with the data of all components, if None
+                  return data of the first component."""
+
+        self.file = ncfile
+        self.components = components
+        self.function = function
+        self.dimensions = self.file.variables[components[0]].dimensions
+        self.shape = self.file.variables[components[0]].shape
+        # maximum number of bytes read at once when reducing variable
+        self.blockbytes = 32*1024*1024
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self,index):
+        data = []
+        for c in self.components:
+            data.append(self.file.variables[c][index])
+        if self.function is None:
+            return data[0]
+        return self.function(*data)
+
+    def blocklen(self):
+        """Number of elements of the first dimension read at once."""
+
+        slicesize = 4*len(self.components)
+        for n in self.shape[1:]:
+            slicesize = slicesize*n
+        return max(1,int(self.blockbytes/max(1,slicesize)))
+
+    def blocks(self):
+        """Iterate over the variable in chunks of the first dimension."""
+
+        step = self.blocklen()
+        for t0 in range(0,self.shape[0],step):
+            yield numpy.asarray(self[t0:min(t0+step,self.shape[0])])
+
+    def min(self):
+        """Minimum of variable."""
+
+        return min([numpy.min(b) for b in self.blocks()])
+
+    def max(self):
+        """Maximum of variable."""
+
+        return max([numpy.max(b) for b in self.blocks()])
+
+    def minmax(self):
+        """Minimum and maximum of variable, computed in a single pass."""
+
+        vmin = None
+        vmax = None
+        for b in self.blocks():
+            (bmin,bmax) = (numpy.min(b),numpy.max(b))
+            if vmin is None or bmin < vmin:
+                vmin = bmin
+            if vmax is None or bmax > vmax:
+                vmax = bmax
+        return (vmin,vmax)
+
+    def mean(self):
+        """Mean of variable."""
+
+        total = 0.
+        num = 0
+        for b in self.blocks():
+            total = total + numpy.sum(b,dtype='d')
+            num = num + b.size
+        return total/num
+
+def calc_magnitude(x, y):
+    """Calculate magnitude of a vector field.
+
+    x, y: components of vector field"""
+
+    return numpy.sqrt(x*x+y*y)
+
+def calc_trapezoid(sigma):
+    """Calculate weights for integrating over sigma levels using the trapezoidal rule.
+
+    sigma: sigma levels"""
+
+    dsigma = sigma[1:]-sigma[:-1]
+    weights = numpy.zeros(len(sigma),'d')
+    weights[:-1] = weights[:-1] + 0.5*dsigma
+    weights[1:] = weights[1:] + 0.5*dsigma
+    return weights
+
+def calc_velogrid(grid):
+    """Interpolate field(s) onto velocity grid.
+
+    grid: array, the last two dimensions are interpolated"""
+
+    return 0.25*(grid[...,:-1,:-1]+grid[...,1:,1:]+grid[...,:-1,1:]+grid[...,1:,:-1])
+
 def calc_pmp(ice_thickness, sigma = 1.):
     """Calculate pressure melting point of ice.
 
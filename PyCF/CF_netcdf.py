@@ -0,0 +1,480 @@
+# Copyright 2004, Magnus Hagdorn
+#
+# This file is part of GLIMMER.
+#
+# GLIMMER is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# GLIMMER is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GLIMMER; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Backends for reading netCDF files.
+
+The mmap backend reads classic and 64-bit offset netCDF files directly. The file
+is memory mapped and variables return numpy views into the file, i.e. no data is
+copied. The scientific backend uses Scientific.IO.NetCDF and is used for files
+the mmap backend cannot handle.
+
+A list of files (or a glob pattern) is opened as a single virtual file where the
+time axes of the individual files are concatenated."""
+
+__all__ = ['CFopen','CFbackends','CFmmapfile','CFmmapvar','CFmultifile','CFmultivar']
+
+import numpy, struct, glob, os.path, Scientific.IO.NetCDF
+
+CFbackends = ['mmap','scientific']
+
+# netCDF header tags
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+# netCDF types
+NC_TYPES = {1 : 'b',
+            2 : 'c',
+            3 : '>i2',
+            4 : '>i4',
+            5 : '>f4',
+            6 : '>f8'}
+
+def CFopen(fname,mode='r',backend=None):
+    """Open a netCDF file.
+
+    fname: name of netCDF file, a list of files or a glob pattern are opened
+           as a CFmultifile
+    mode: file mode, only the scientific backend can write files
+    backend: one of CFbackends, if None try the mmap backend first when reading
+             and fall back to the scientific backend."""
+
+    if backend not in [None]+CFbackends:
+        raise ValueError, 'Unknown netCDF backend %s'%backend
+    if mode == 'r':
+        if type(fname) != list and type(fname) != tuple:
+            if not os.path.exists(fname) and glob.has_magic(fname):
+                fname = glob.glob(fname)
+                if len(fname) == 0:
+                    raise IOError, 'No files matching pattern'
+        if type(fname) == list or type(fname) == tuple:
+            if len(fname) == 1:
+                fname = fname[0]
+            else:
+                return CFmultifile(fname,backend=backend)
+    if mode == 'r' and backend in [None,'mmap']:
+        try:
+            return CFmmapfile(fname)
+        except (ValueError, NotImplementedError):
+            if backend == 'mmap':
+                raise
+    return Scientific.IO.NetCDF.NetCDFFile(fname,mode)
+
+class CFmmapfile(object):
+    """Read-only memory mapped classic netCDF file.
+
+    Provides the same interface as Scientific.IO.NetCDF.NetCDFFile for reading, i.e.
+    global attributes are attributes of the object and the dictionaries dimensions
+    and variables."""
+
+    def __init__(self,fname):
+        """Initialise.
+
+        fname: name of netCDF file."""
+
+        self.__dict__['_CFmmapfile__attribs'] = []
+        infile = open(fname,'rb')
+        try:
+            magic = infile.read(4)
+            if len(magic) != 4 or magic[:3] != 'CDF':
+                raise NotImplementedError, '%s is not a classic netCDF file'%fname
+            version = ord(magic[3])
+            if version not in [1,2]:
+                raise NotImplementedError, 'netCDF format version %d is not supported'%version
+            self.__infile = infile
+            numrecs = self.__int()
+
+            # dimensions
+            self.dimensions = {}
+            dimnames = []
+            recdim = None
+            for i in range(self.__listlen(NC_DIMENSION)):
+                name = self.__name()
+                length = self.__int()
+                if length == 0:
+                    recdim = name
+                    self.dimensions[name] = None
+                else:
+                    self.dimensions[name] = length
+                dimnames.append(name)
+            # global attributes
+            for (name,value) in self.__attributes():
+                self.__dict__[name] = value
+                self.__attribs.append(name)
+            # variables
+            varinfo = []
+            for i in range(self.__listlen(NC_VARIABLE)):
+                name = self.__name()
+                dims = []
+                for j in range(self.__int()):
+                    dims.append(dimnames[self.__int()])
+                attribs = self.__attributes()
+                nctype = self.__int()
+                vsize = self.__int()
+                if version == 1:
+                    begin = self.__int()
+                else:
+                    raw = infile.read(8)
+                    if len(raw) != 8:
+                        raise ValueError, 'Truncated netCDF header'
+                    begin = struct.unpack('>q',raw)[0]
+                if nctype not in NC_TYPES:
+                    raise ValueError, 'Unknown netCDF type %d'%nctype
+                varinfo.append((name,tuple(dims),attribs,NC_TYPES[nctype],vsize,begin))
+        finally:
+            infile.close()
+            self.__infile = None
+
+        self.__data = numpy.memmap(fname,dtype='B',mode='r')
+
+        # record layout
+        isrec = [len(v[1])>0 and v[1][0] == recdim for v in varinfo]
+        recsize = 0
+        for i in range(len(varinfo)):
+            if isrec[i]:
+                recsize = recsize + varinfo[i][4]
+        if isrec.count(True) == 1:
+            v = varinfo[isrec.index(True)]
+            recsize = numpy.dtype(v[3]).itemsize
+            for d in v[1][1:]:
+                recsize = recsize*self.dimensions[d]
+        if numrecs == -1 and recsize > 0:
+            # streaming, compute number of records from file size
+            begin = min([varinfo[i][5] for i in range(len(varinfo)) if isrec[i]])
+            numrecs = (len(self.__data)-begin)//recsize
+        self.numrecs = numrecs
+
+        self.variables = {}
+        for i in range(len(varinfo)):
+            (name,dims,attribs,dtype,vsize,begin) = varinfo[i]
+            shape = []
+            for d in dims:
+                if d == recdim:
+                    shape.append(numrecs)
+                else:
+                    shape.append(self.dimensions[d])
+            self.variables[name] = CFmmapvar(self.__data,name,dims,shape,dtype,begin,attribs,
+                                             isrec[i] and recsize or None)
+
+    def __int(self):
+        raw = self.__infile.read(4)
+        if len(raw) != 4:
+            raise ValueError, 'Truncated netCDF header'
+        return struct.unpack('>i',raw)[0]
+
+    def __name(self):
+        n = self.__int()
+        name = self.__infile.read(n)
+        self.__infile.read((4-n%4)%4)
+        return name
+
+    def __listlen(self,tag):
+        t = self.__int()
+        n = self.__int()
+        if t == 0 and n == 0:
+            return 0
+        if t != tag:
+            raise ValueError, 'Corrupt netCDF header'
+        return n
+
+    def __attributes(self):
+        attribs = []
+        for i in range(self.__listlen(NC_ATTRIBUTE)):
+            name = self.__name()
+            nctype = self.__int()
+            n = self.__int()
+            if nctype not in NC_TYPES:
+                raise ValueError, 'Unknown netCDF type %d'%nctype
+            dtype = numpy.dtype(NC_TYPES[nctype])
+            nbytes = n*dtype.itemsize
+            raw = self.__infile.read(nbytes)
+            self.__infile.read((4-nbytes%4)%4)
+            if nctype == 2:
+                value = raw.rstrip('\0')
+            else:
+                value = numpy.fromstring(raw,dtype=dtype).astype(dtype.newbyteorder('='))
+            attribs.append((name,value))
+        return attribs
+
+    def __setattr__(self,name,value):
+        if name in self.__attribs:
+            raise AttributeError, 'netCDF file is read-only'
+        object.__setattr__(self,name,value)
+
+    def close(self):
+        """Close file."""
+
+        self.variables = {}
+        self.__data = None
+
+class CFmmapvar(object):
+    """Variable of memory mapped netCDF file.
+
+    attributes of the netCDF variable are attributes of the object."""
+
+    def __init__(self,data,name,dimensions,shape,dtype,begin,attribs,recsize=None):
+        """Initialise.
+
+        data: memory map of file
+        name: name of variable
+        dimensions: tuple of dimension names
+        shape: shape of variable
+        dtype: numpy data type of variable
+        begin: offset of variable in file
+        attribs: list of (name, value) attribute pairs
+        recsize: size of a record if this is a record variable"""
+
+        for (aname,value) in attribs:
+            setattr(self,aname,value)
+        self.name = name
+        self.dimensions = dimensions
+        self.shape = tuple(shape)
+
+        dtype = numpy.dtype(dtype)
+        strides = []
+        stride = dtype.itemsize
+        for n in self.shape[::-1]:
+            strides.insert(0,stride)
+            stride = stride*n
+        if recsize is not None:
+            strides[0] = recsize
+        # number of bytes spanned by variable
+        size = dtype.itemsize
+        for i in range(len(self.shape)):
+            size = size + (self.shape[i]-1)*strides[i]
+        if 0 in self.shape:
+            size = 0
+        # the file may be shorter than its header says, e.g. while it is being written
+        if begin+size > len(data):
+            raise ValueError, 'Variable %s extends beyond end of file'%name
+        self.__array = numpy.ndarray(shape=self.shape,dtype=dtype,buffer=data[begin:begin+size],
+                                     strides=tuple(strides))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self,index):
+        return self.__array[index]
+
+    def getValue(self):
+        """Get value of a scalar variable."""
+
+        return self.__array[()]
+
+    def typecode(self):
+        """Get type code of variable."""
+
+        return self.__array.dtype.char
+
+class CFmultifile(object):
+    """Read-only virtual netCDF file concatenating a number of files along time.
+
+    All files must have the same grid. The files are ordered by their first time and
+    time slices which are repeated at the start of a file (e.g. when a run was
+    restarted) are skipped. Files are only opened when data is read from them and at
+    most maxopen files are kept open at the same time.
+
+    Global attributes and variables without a time dimension are taken from the first
+    file."""
+
+    def __init__(self,fnames,backend=None,maxopen=16):
+        """Initialise.
+
+        fnames: list of names of netCDF files
+        backend: netCDF backend used for the individual files, see CFopen
+        maxopen: maximum number of open files."""
+
+        self.__dict__['_CFmultifile__first'] = None
+        self.backend = backend
+        self.maxopen = maxopen
+        self.__handles = {}
+        self.__tick = 0
+
+        # index of time ranges
+        starts = []
+        for f in fnames:
+            ncfile = CFopen(f,'r',backend=backend)
+            if 'time' not in ncfile.variables.keys():
+                raise ValueError, 'File %s has no time axis'%f
+            times = numpy.asarray(ncfile.variables['time'][:],'d')
+            if len(times) > 0:
+                starts.append((times[0],f,times))
+            ncfile.close()
+        if len(starts) == 0:
+            raise ValueError, 'Files do not contain any time slices'
+        starts.sort()
+
+        self.fnames = []
+        # first record of file used and number of records used
+        self.recstart = []
+        self.numrecs = []
+        last = None
+        for (t0,f,times) in starts:
+            if last is None:
+                first = 0
+            else:
+                first = numpy.searchsorted(times,last,side='right')
+            if first == len(times):
+                continue
+            self.fnames.append(f)
+            self.recstart.append(int(first))
+            self.numrecs.append(len(times)-int(first))
+            last = times[-1]
+        # position of the first record of each file in the concatenated time axis
+        self.offsets = numpy.concatenate(([0],numpy.cumsum(self.numrecs)))
+
+        # check grids and set up variables
+        self.__dict__['_CFmultifile__first'] = self.handle(0)
+        self.dimensions = self.__first.dimensions
+        recdim = None
+        for d in self.dimensions.keys():
+            if self.dimensions[d] is None:
+                recdim = d
+        for i in range(1,len(self.fnames)):
+            ncfile = self.handle(i)
+            for d in self.dimensions.keys():
+                if d != recdim and ncfile.dimensions.get(d,None) != self.dimensions[d]:
+                    raise ValueError, 'Grid of %s does not match grid of %s'%(self.fnames[i],self.fnames[0])
+            for d in ['x0','y0','x1','y1']:
+                if d in self.__first.variables.keys():
+                    if (numpy.asarray(ncfile.variables[d][:]) != numpy.asarray(self.__first.variables[d][:])).any():
+                        raise ValueError, 'Grid of %s does not match grid of %s'%(self.fnames[i],self.fnames[0])
+        self.variables = {}
+        for name in self.__first.variables.keys():
+            var = self.__first.variables[name]
+            if len(var.dimensions) > 0 and var.dimensions[0] == recdim:
+                self.variables[name] = CFmultivar(self,name)
+            else:
+                self.variables[name] = var
+
+    def __getattr__(self,name):
+        # global attributes of first file
+        if self.__first is None:
+            raise AttributeError, name
+        return getattr(self.__first,name)
+
+    def handle(self,i):
+        """Get netCDF file object of the ith file, opening it if necessary.
+
+        i: index of file."""
+
+        self.__tick = self.__tick + 1
+        if i not in self.__handles:
+            if len(self.__handles) >= self.maxopen:
+                # close least recently used file, the first file is kept open
+                lru = None
+                for j in self.__handles:
+                    if j != 0 and (lru is None or self.__handles[j][0] < self.__handles[lru][0]):
+                        lru = j
+                if lru is not None:
+                    self.__handles[lru][1].close()
+                    del self.__handles[lru]
+            self.__handles[i] = [self.__tick,CFopen(self.fnames[i],'r',backend=self.backend)]
+        self.__handles[i][0] = self.__tick
+        return self.__handles[i][1]
+
+    def locate(self,records):
+        """Find files holding records.
+
+        records: array of record numbers of the virtual file
+
+        returns a tuple of arrays (file index, record in file)."""
+
+        records = numpy.asarray(records)
+        i = numpy.searchsorted(self.offsets,records,side='right')-1
+        return (i,records-self.offsets[i]+numpy.take(self.recstart,i))
+
+    def close(self):
+        """Close all files."""
+
+        for i in self.__handles.keys():
+            self.__handles[i][1].close()
+        self.__handles = {}
+        self.variables = {}
+
+class CFmultivar(object):
+    """Variable with a time dimension of a CFmultifile.
+
+    attributes are taken from the variable of the first file."""
+
+    def __init__(self,multifile,name):
+        """Initialise.
+
+        multifile: CFmultifile
+        name: name of variable"""
+
+        self.__dict__['_CFmultivar__first'] = multifile.handle(0).variables[name]
+        self.multifile = multifile
+        self.name = name
+        self.dimensions = self.__first.dimensions
+        self.shape = (int(multifile.offsets[-1]),)+tuple(self.__first.shape[1:])
+
+    def __getattr__(self,name):
+        return getattr(self.__first,name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self,index):
+        if type(index) != tuple:
+            index = (index,)
+        (tindex,rest) = (index[0],index[1:])
+        if isinstance(tindex,slice):
+            records = numpy.arange(self.shape[0])[tindex]
+        else:
+            tindex = int(tindex)
+            if tindex < 0:
+                tindex = tindex + self.shape[0]
+            if tindex < 0 or tindex >= self.shape[0]:
+                raise IndexError, 'time index out of range'
+            records = numpy.array([tindex])
+        if len(records) == 0:
+            data = numpy.asarray(self.__first[(slice(0,0),)+rest])
+            if not isinstance(tindex,slice):
+                return data[0]
+            return data
+        (files,local) = self.multifile.locate(records)
+        step = 1
+        if len(records) > 1:
+            step = int(records[1]-records[0])
+        # read runs of records stored in the same file
+        data = []
+        breaks = numpy.concatenate(([0],numpy.nonzero(files[1:] != files[:-1])[0]+1,[len(records)]))
+        for k in range(len(breaks)-1):
+            (r0,r1) = (breaks[k],breaks[k+1]-1)
+            stop = int(local[r1])+step
+            if stop < 0:
+                stop = None
+            var = self.multifile.handle(int(files[r0])).variables[self.name]
+            data.append(numpy.asarray(var[(slice(int(local[r0]),stop,step),)+rest]))
+        if len(data) == 1:
+            data = data[0]
+        else:
+            data = numpy.concatenate(data)
+        if not isinstance(tindex,slice):
+            return data[0]
+        return data
+
+    def getValue(self):
+        """Get all values of variable."""
+
+        return self[:]
+
+    def typecode(self):
+        """Get type code of variable."""
+
+        return self.__first.typecode()
@@ -25,6 +25,7 @@ from CF_loadfile import *
 from CF_profile import *
 from CF_rsl import CFRSLlocs
 from CF_IOmisc import CFreadlines
+from CF_output import *
 
 class CFOptParser(optparse.OptionParser):
     """Handle options."""
@@ -163,6 +164,10 @@ class CFOptParser(optparse.OptionParser):
         """Glacial Stages."""
         self.add_option("-e","--epoch",metavar='NAME',type="string",help='load glacial stages from file and plot them on time axis')
 
+    def output(self):
+        """Output format options."""
+        self.add_option("--format",type="choice",choices=CFoutput_formats,default='text',help="format of output file, can be one of %s (default: text)"%str(CFoutput_formats))
+
     def rsl(self):
         """RSL options."""
         self.add_option("-r","--rsldb",metavar='DB',type="string",default=self.rsldb,help="name of RSL database file [%s]"%self.rsldb)
@@ -270,6 +275,19 @@ class CFOptions(object):
         
         return infile
 
+    def output(self,record='time',sep='\t',argn=-1):
+        """Open output file.
+
+        record: name of record dimension
+        sep: column separator used for text output
+        argn: number of argument holding output name."""
+
+        try:
+            format = self.options.format
+        except:
+            format = 'text'
+        return CFoutput(self.args[argn],format=format,record=record,sep=sep)
+
     def cfprofile(self,argn=0):
         """Load CF profile.
 
@@ -0,0 +1,265 @@
+# Copyright 2004, Magnus Hagdorn
+#
+# This file is part of GLIMMER.
+#
+# GLIMMER is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# GLIMMER is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with GLIMMER; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Writing extracted data in a number of formats.
+
+Data is written as records along a record dimension (e.g. time), each record holds a
+number of fields. Records are written as they are produced, i.e. the output never has
+to be held in memory.
+
+text:   one line per record (the traditional output of the extract tools)
+npy:    a single 2D array [record,column] with the same columns as the text output,
+        can be loaded zero-copy using numpy.load(fname,mmap_mode='r')
+npz:    one array per field and coordinate
+netcdf: CF netCDF file created via CFcreatefile"""
+
+__all__ = ['CFoutput','CFoutput_formats']
+
+import numpy, struct, os, zipfile, tempfile, StringIO
+from CF_IOmisc import CFcolumnwriter
+from CF_createfile import CFcreatefile
+
+CFoutput_formats = ['text','npy','npz','netcdf']
+
+class CFoutput(object):
+    """Write records of data.
+
+    usage: declare coordinates and fields, then write blocks of records."""
+
+    def __init__(self,fname,format='text',record='time',sep='\t'):
+        """Initialise.
+
+        fname: name of output file
+        format: one of CFoutput_formats
+        record: name of record dimension
+        sep: column separator used for text output"""
+
+        if format not in CFoutput_formats:
+            raise ValueError, 'Unknown output format %s'%format
+        self.fname = fname
+        self.format = format
+        self.record = record
+        self.sep = sep
+        self.numrecs = 0
+        self.__fields = []
+        self.__dims = {}
+        self.__coords = []
+        self.__started = False
+
+        if self.format == 'text':
+            self.__file = open(fname,'w')
+            self.__writer = CFcolumnwriter(self.__file,sep=sep)
+        elif self.format == 'npy':
+            self.__file = _CFnpywriter(fname)
+        elif self.format == 'npz':
+            self.__tmpdir = tempfile.mkdtemp()
+            self.__file = {}
+        else:
+            self.__file = CFcreatefile(fname)
+            self.__file.mapvarname = ''
+            self.__file.createDimension(record,None)
+
+    def attribute(self,name,value):
+        """Set a global attribute (only used for netCDF output).
+
+        name: name of attribute
+        value: value of attribute"""
+
+        if self.format == 'netcdf':
+            setattr(self.__file.file,name,value)
+
+    def text(self,text):
+        """Write text (only used for text output), e.g. header lines.
+
+        text: string to be written."""
+
+        if self.format == 'text':
+            self.__writer.flush()
+            self.__file.write(text)
+
+    def coord(self,name,values,dim=None,units='',long_name=''):
+        """Add a coordinate variable.
+
+        name: name of coordinate
+        values: values of coordinate
+        dim: name of dimension, if None use name and create a new dimension
+        units: units of coordinate
+        long_name: long name of coordinate
+
+        coordinates are not written to text and npy output."""
+
+        if self.__started:
+            raise RuntimeError, 'Coordinates must be defined before writing records'
+        values = numpy.asarray(values)
+        if dim is None:
+            dim = name
+        if dim not in self.__dims:
+            self.__dims[dim] = len(values)
+            if self.format == 'netcdf':
+                self.__file.createDimension(dim,len(values))
+        elif self.__dims[dim] != len(values):
+            raise ValueError, 'Coordinate %s does not match dimension %s'%(name,dim)
+        self.__coords.append((name,values))
+        if self.format == 'netcdf':
+            var = self.__createVariable(name,(dim,),units,long_name)
+            var[:] = values
+
+    def field(self,name,dims=(),units='',long_name='',text=True):
+        """Add a field.
+
+        name: name of field
+        dims: tuple of dimensions (excluding the record dimension)
+        units: units of field
+        long_name: long name of field
+        text: set to False if field is not written to text and npy output"""
+
+        if self.__started:
+            raise RuntimeError, 'Fields must be defined before writing records'
+        shape = []
+        for d in dims:
+            if d not in self.__dims:
+                raise KeyError, 'Unknown dimension %s'%d
+            shape.append(self.__dims[d])
+        self.__fields.append((name,tuple(shape),text))
+        if self.format == 'netcdf':
+            self.__createVariable(name,(self.record,)+tuple(dims),units,long_name)
+
+    def write(self,**data):
+        """Write a block of records.
+
+        data: arrays for all fields, keyed by field name. The first dimension selects
+              the record, single values are repeated for all records."""
+
+        self.__started = True
+        n = 1
+        for (name,shape,text) in self.__fields:
+            if name not in data:
+                raise KeyError, 'No data for field %s'%name
+            d = numpy.asarray(data[name])
+            if d.ndim > len(shape):
+                n = max(n,len(d))
+        block = []
+        for (name,shape,text) in self.__fields:
+            d = numpy.asarray(data[name],'d')
+            if d.ndim == len(shape):
+                d = numpy.repeat(d[numpy.newaxis,...],n,axis=0)
+            if d.shape != (n,)+shape:
+                raise ValueError, 'Field %s has wrong shape %s'%(name,str(d.shape))
+            block.append((name,d,text))
+
+        if self.format == 'text':
+            columns = []
+            for (name,d,text) in block:
+                if text:
+                    columns.extend(numpy.transpose(numpy.reshape(d,(n,-1))))
+            self.__writer.write(*columns)
+        elif self.format == 'npy':
+            columns = [numpy.reshape(d,(n,-1)) for (name,d,text) in block if text]
+            self.__file.write(numpy.concatenate(columns,axis=1))
+        elif self.format == 'npz':
+            for (name,d,text) in block:
+                if name not in self.__file:
+                    self.__file[name] = _CFnpywriter(os.path.join(self.__tmpdir,name+'.npy'))
+                self.__file[name].write(d)
+        else:
+            for (name,d,text) in block:
+                self.__file.file.variables[name][self.numrecs:self.numrecs+n] = d.astype('f')
+        self.numrecs = self.numrecs + n
+
+    def close(self):
+        """Close output file."""
+
+        if self.format == 'text':
+            self.__writer.close()
+            self.__file.close()
+        elif self.format == 'npy':
+            self.__file.close()
+        elif self.format == 'npz':
+            outfile = zipfile.ZipFile(self.fname,'w',zipfile.ZIP_STORED,allowZip64=True)
+            for (name,values) in self.__coords:
+                buf = StringIO.StringIO()
+                numpy.save(buf,values)
+                outfile.writestr(name+'.npy',buf.getvalue())
+            for (name,shape,text) in self.__fields:
+                if name not in self.__file:
+                    self.__file[name] = _CFnpywriter(os.path.join(self.__tmpdir,name+'.npy'),shape)
+                self.__file[name].close()
+                outfile.write(self.__file[name].fname,name+'.npy')
+                os.remove(self.__file[name].fname)
+            outfile.close()
+            os.rmdir(self.__tmpdir)
+        else:
+            self.__file.close()
+
+    def __createVariable(self,name,dims,units,long_name):
+        """Create a netCDF variable, use CF definition if available."""
+
+        cffile = self.__file
+        if name in cffile.vars:
+            defdims = tuple(cffile.vars[name]['dimensions'].replace(' ','').split(','))
+            if defdims == dims:
+                return cffile.createVariable(name)
+        var = cffile.file.createVariable(name,'f',dims)
+        if units != '':
+            var.units = units
+        if long_name != '':
+            var.long_name = long_name
+        return var
+
+class _CFnpywriter(object):
+    """Write a .npy file incrementally along its first dimension.
+
+    space for the header is reserved and the header is rewritten when the file is
+    closed."""
+
+    HEADERLEN = 128
+
+    def __init__(self,fname,shape=None):
+        """Initialise.
+
+        fname: name of file
+        shape: shape of a record, if None use shape of first block written."""
+
+        self.fname = fname
+        self.shape = shape
+        self.numrecs = 0
+        self.__file = open(fname,'wb')
+        self.__file.write(' '*self.HEADERLEN)
+
+    def write(self,data):
+        """Write a block of records."""
+
+        data = numpy.asarray(data,'<f8')
+        if self.shape is None:
+            self.shape = data.shape[1:]
+        if data.shape[1:] != tuple(self.shape):
+            raise ValueError, 'Data does not match previous records'
+        self.__file.write(data.tostring())
+        self.numrecs = self.numrecs + len(data)
+
+    def close(self):
+        """Write header and close file."""
+
+        shape = (self.numrecs,)+tuple(self.shape or ())
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': %s, }"%str(shape)
+        if len(header) >= self.HEADERLEN-10:
+            raise RuntimeError, 'Too many dimensions'
+        header = header + ' '*(self.HEADERLEN-10-len(header)-1) + '\n'
+        self.__file.seek(0)
+        self.__file.write('\x93NUMPY\x01\x00'+struct.pack('<H',len(header))+header)
+        self.__file.close()
@@ -18,13 +18,15 @@
 
 """Loading CF profiles files."""
 
-__all__=['CFprofile','CFloadprofile','CFprofvar']
+__all__=['CFprofile','CFprofilebundle','CFloadprofile','CFprofvar','CFgetExtents']
 
-import numpy, PyGMT
+import numpy, PyGMT, glob, os.path
 from CF_loadfile import *
+from CF_interpolate import *
+from CF_cache import *
+from CF_createfile import CFcreatefile
 from CF_utils import CFinterpolate_xy
 from PyGMT import Grid
-from CF_utils import CFinterpolate_linear
 from CF_IOmisc import CFreadlines
 
 class CFprofile(object):
@@ -43,6 +45,8 @@ class CFprofile(object):
         self.interval = interval
         self.xscale = xscale
         self.xrange = xrange
+        # interpolation weights along profile
+        self.__samplers = {}
 
     def set_control_points(self,xloc,yloc,projected=True):
         """Set control points.
@@ -55,13 +59,10 @@ class CFprofile(object):
             self.xloc = xloc
             self.yloc = yloc
         else:
-            self.xloc = []
-            self.yloc = []
-            for i in range(0,len(xloc)):
-                point = self.cffile.project([xloc[i],yloc[i]])
-                self.xloc.append(point[0])
-                self.yloc.append(point[1])
-                
+            points = self.cffile.project_points([xloc,yloc])
+            self.xloc = points[0,:].tolist()
+            self.yloc = points[1,:].tolist()
+
         self.interpolated = CFinterpolate_xy([self.xloc,self.yloc],self.interval)
         
         self.interval = self.interval*self.xscale
@@ -75,21 +76,33 @@ class CFprofile(object):
             end = int(self.xrange[1]/self.interval+0.9999)
         self.interpolated = self.interpolated[:,start:end]
         self.xrange = [start*self.interval, end*self.interval]
-        self.xvalues = []
-        for i in range(0,len(self.interpolated[1,:])):
-            self.xvalues.append(self.xrange[0]+i*self.interval)
+        xvalues = self.xrange[0]+numpy.arange(len(self.interpolated[1,:]))*self.interval
 
         # clip to region of file
-        interpx = []
-        interpy = []
-        xvalues = []
-        for i in range(0,len(self.interpolated[1,:])):
-            if self.cffile.inside(self.interpolated[:,i]):
-                interpx.append(self.interpolated[0,i])
-                interpy.append(self.interpolated[1,i])
-                xvalues.append(self.xvalues[i])
-        self.xvalues = xvalues
-        self.interpolated = numpy.array([interpx,interpy],'f')
+        inside = self.cffile.inside_points(self.interpolated)
+        self.xvalues = xvalues[inside].tolist()
+        self.interpolated = numpy.array(self.interpolated[:,inside],'f')
+        self.__samplers = {}
+
+    def getsampler(self,var,method='bicubic'):
+        """Get interpolator sampling a variable along the profile.
+
+        var: CF variable
+        method: 'bicubic' or 'bilinear'
+
+        the interpolation weights only depend on the grid and the profile, they are
+        computed once and shared by all variables on the same grid."""
+
+        key = (var.xdimension,method)
+        if key not in self.__samplers:
+            if method == 'bicubic':
+                sampler = CFspline2D
+            elif method == 'bilinear':
+                sampler = CFbilinear2D
+            else:
+                raise ValueError, 'Unknown interpolation method %s'%method
+            self.__samplers[key] = sampler(var.xdim[:],var.ydim[:],self.interpolated)
+        return self.__samplers[key]
 
     def coords_file(self,fname,projected=True):
         """Read control points from file.
@@ -109,10 +122,186 @@ class CFprofile(object):
         self.set_control_points(xdata,ydata,projected=projected)
                                           
                                           
+class CFprofilebundle(object):
+    """A number of profile lines on the same CF file.
+
+    All profiles are extracted in a single pass over the file, i.e. each time slice is
+    read once and sampled along all profiles."""
+
+    def __init__(self,cffile,interval=10000.,xscale=0.001):
+        """Initialise.
+
+        cffile: CF file object
+        interval: linearly interpolate profiles
+        xscale: scale x values
+        """
+
+        self.cffile = cffile
+        self.interval = interval
+        self.xscale = xscale
+        self.profiles = []
+        self.names = []
+        # fill value used for samples outside the grid and padding
+        self.fillvalue = 9.96921e+36
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def add(self,xloc,yloc,projected=True,name=None,xrange=[None,None]):
+        """Add a profile.
+
+        xloc/yloc: control points along profile.
+        projected: set to True (Default) if xloc/yloc are in projected coord system
+        name: name of profile
+        xrange: clip profile (Default [None,None])
+
+        returns the CFprofile"""
+
+        profile = CFprofile(self.cffile,interval=self.interval,xrange=xrange,xscale=self.xscale)
+        profile.set_control_points(xloc,yloc,projected=projected)
+        if name is None:
+            name = 'profile%d'%len(self.profiles)
+        self.profiles.append(profile)
+        self.names.append(name)
+        return profile
+
+    def add_files(self,fnames,projected=True):
+        """Add profiles from files containing control points.
+
+        fnames: name of file, list of file names or glob pattern
+        projected: set to True (Default) if xloc/yloc are in projected coord system
+        """
+
+        if type(fnames) != list and type(fnames) != tuple:
+            fnames = glob.glob(fnames)
+            fnames.sort()
+        for fname in fnames:
+            profile = CFprofile(self.cffile,interval=self.interval,xscale=self.xscale)
+            profile.coords_file(fname,projected=projected)
+            self.profiles.append(profile)
+            self.names.append(os.path.splitext(os.path.basename(fname))[0])
+
+    def blocks(self,var,time=None,level=0,step=1,method='bicubic'):
+        """Iterate over blocks of time slices sampled along all profiles.
+
+        var: name of variable
+        time: if None, return data for all time slices
+              if list/etc of size two, interpret as array selection
+              if single value, get only this time slice
+        level: horizontal slice
+        step: only use every step time slice
+        method: interpolation method, 'bicubic' or 'bilinear'
+
+        yields a tuple of the time slice range (t0,t1) of the block and a list of arrays
+        [time,distance], one for each profile."""
+
+        var = self.cffile.getvar(var)
+        samplers = [p.getsampler(var,method) for p in self.profiles]
+        (tarray,t) = CFchecklist(time,self.cffile.timeaxis)
+        if not tarray:
+            t = [t,t]
+        chunk = self.cffile.blocksize*step
+        for t0 in range(t[0],t[1]+1,chunk):
+            t1 = min(t0+chunk-1,t[1])
+            data = var.get2Dfields([t0,t1],level=level,step=step)
+            yield ((t0,t1),[s.eval(data) for s in samplers])
+
+    def getProfiles(self,var,time=None,level=0,step=1,method='bicubic'):
+        """Get profiles of a variable along all profile lines.
+
+        var: name of variable
+        time: if None, return data for all time slices
+              if list/etc of size two, interpret as array selection
+              if single value, get only this time slice
+        level: horizontal slice
+        step: only use every step time slice
+        method: interpolation method, 'bicubic' or 'bilinear'
+
+        returns a list of arrays [time,distance] or [distance] if time is a single value,
+        one for each profile."""
+
+        data = [[] for p in self.profiles]
+        for (t,block) in self.blocks(var,time=time,level=level,step=step,method=method):
+            for i in range(len(self.profiles)):
+                data[i].append(block[i])
+        data = [numpy.concatenate(d) for d in data]
+        (tarray,t) = CFchecklist(time,self.cffile.timeaxis)
+        if not tarray:
+            data = [d[0] for d in data]
+        return data
+
+    def writeCF(self,fname,vars,time=None,level=0,step=1,method='bicubic'):
+        """Write profiles of a number of variables to a single netCDF file.
+
+        fname: name of output file
+        vars: list of variable names
+        time: if None, write data for all time slices
+              if list/etc of size two, interpret as array selection
+        level: horizontal slice
+        step: only use every step time slice
+        method: interpolation method, 'bicubic' or 'bilinear'
+
+        the profiles are stacked along a profile dimension, shorter profiles are padded
+        with fillvalue. Each block of time slices is written as soon as it is extracted."""
+
+        numd = max([len(p.xvalues) for p in self.profiles])
+        outfile = CFcreatefile(fname)
+        outfile.mapvarname = ''
+        outfile.title = 'profiles extracted from %s'%self.cffile.title
+        outfile.createDimension('time',None)
+        outfile.createDimension('profile',len(self.profiles))
+        outfile.createDimension('distance',numd)
+        ncfile = outfile.file
+        ncfile.profiles = ', '.join(self.names)
+
+        intime = self.cffile.file.variables['time']
+        timevar = ncfile.createVariable('time','f',('time',))
+        for a in ['units','long_name','standard_name','calendar']:
+            if hasattr(intime,a):
+                setattr(timevar,a,getattr(intime,a))
+        coords = {}
+        for (name,long_name) in [('distance','distance along profile'),('x','projected x coordinate'),
+                                 ('y','projected y coordinate')]:
+            coords[name] = ncfile.createVariable(name,'f',('profile','distance'))
+            coords[name].long_name = long_name
+            coords[name]._FillValue = numpy.array(self.fillvalue,'f')
+        coords['distance'].units = 'km'
+        for c in ['x','y']:
+            coords[c].units = 'meter'
+        for i in range(len(self.profiles)):
+            data = numpy.zeros([3,numd],'f')+self.fillvalue
+            n = len(self.profiles[i].xvalues)
+            data[0,:n] = self.profiles[i].xvalues
+            data[1:,:n] = self.profiles[i].interpolated
+            for j in range(3):
+                coords[['distance','x','y'][j]][i,:] = data[j,:]
+
+        outvars = []
+        for v in vars:
+            cfvar = self.cffile.getvar(v)
+            ncvar = ncfile.createVariable(v,'f',('time','profile','distance'))
+            ncvar.units = cfvar.units
+            ncvar.long_name = cfvar.long_name
+            ncvar._FillValue = numpy.array(self.fillvalue,'f')
+            outvars.append(ncvar)
+
+        for i in range(len(vars)):
+            n = 0
+            for ((t0,t1),block) in self.blocks(vars[i],time=time,level=level,step=step,method=method):
+                data = numpy.zeros([len(block[0]),len(self.profiles),numd],'f')+self.fillvalue
+                for j in range(len(self.profiles)):
+                    data[:,j,:block[j].shape[1]] = numpy.where(numpy.isnan(block[j]),self.fillvalue,block[j])
+                if i == 0:
+                    timevar[n:n+len(data)] = numpy.asarray(intime[t0:t1+1:step],'f')
+                outvars[i][n:n+len(data)] = data
+                n = n + len(data)
+        outfile.close()
+
 class CFloadprofile(CFloadfile):
     """Loading a profile line from a CF netCDF file."""
 
-    def __init__(self,fname,xloc,yloc,projected=True,interval=10000.,xrange=[None, None],xscale=0.001):
+    def __init__(self,fname,xloc,yloc,projected=True,interval=10000.,xrange=[None, None],xscale=0.001,
+                 profilecachesize=16*1024*1024):
         """Initialise.
 
         fname: name of CF file.
@@ -121,6 +310,7 @@ class CFloadprofile(CFloadfile):
         interval: linearly interpolate profile
         xrange: clip profile (Default [None,None])
         xscale: scale x values
+        profilecachesize: maximum number of bytes used for caching profiles
         """
         
         CFloadfile.__init__(self,fname)
@@ -136,6 +326,8 @@ class CFloadprofile(CFloadfile):
         
         # caching profiles
         self.__profiles = {}
+        # sampled profiles shared by all profile variables
+        self.profilecache = CFcache(profilecachesize)
 
     def getprofile(self,var):
         """Get a profile variable from file.
@@ -148,7 +340,15 @@ class CFloadprofile(CFloadfile):
             self.__profiles[var] = CFprofvar(self,var)
         return self.__profiles[var]
 
-    def getExtent(self,time=None,interval=1):
+    def getsampler(self,var,method='bicubic'):
+        """Get interpolator sampling a variable along the profile.
+
+        var: CF variable
+        method: 'bicubic' or 'bilinear'"""
+
+        return self.profiledata.getsampler(var,method)
+
+    def getExtent(self,time=None,interval=1,subsample=False):
         """Get ice extent along profile.
 
         time: if None, return data for all time slices
@@ -156,28 +356,16 @@ class CFloadprofile(CFloadfile):
               if single value, get only this time slice
 
         interval: extract every interval timeslice      
+        subsample: interpolate position of margin between samples
 
-        this is a hack, we start looking from the end of the profile and stop when we found
-        a change from no ice to ice."""
+        see CFgetExtents."""
 
-        (tarray,t) = CFchecklist(time,self.file.variables['time'])
-        values = []
+        (tarray,t) = CFchecklist(time,self.timeaxis)
+        values = CFgetExtents(self,[self.profiledata],time=time,interval=interval,subsample=subsample,
+                              method=self.getprofile('thk').interpolation)[0]
         if tarray:
-            for i in range(t[0],t[1]+1,interval):
-                values.append(self.__getExtent(i))
-            return values
-        return self.__getExtent(t)
-
-    def __getExtent(self,time):
-        data = self.getprofile('thk').getProfile(time)
-        #right BC
-        if data[-1] > 0. and data[-1]<1.e10:
-            return self.xvalues[-1]
-        for i in range(len(data[:])-2,0,-1):
-            if data[i] > 0. and data[i]<1.e10:
-                return self.xvalues[i]
-        # if we are at the end we just return position of last value to close data set
-        return self.xvalues[0]
+            return values.tolist()
+        return values
 
 class CFprofvar(CFvariable):
     """Handling CF Profiles."""
@@ -189,6 +377,8 @@ class CFprofvar(CFvariable):
         var: name of variable"""
 
         self.yres = 10.
+        # interpolation method used for sampling along profile, 'bicubic' or 'bilinear'
+        self.interpolation = 'bicubic'
 
         if not isinstance(cfprofile,CFloadprofile):
             raise ValueError, 'Not a profile file'
@@ -196,25 +386,67 @@ class CFprofvar(CFvariable):
         CFvariable.__init__(self,cfprofile,var)
         self.showpmp = False
 
-        #cache profile data
-        self.__data = {}
-        self.__data2d = {}
-        
+    def __cachekey(self,kind,time,*args):
+        """Key identifying cached profile data."""
+
+        if time < 0:
+            time = time + self.cffile.numt
+        return (kind,self.name,self.average,self.pmt,self.interpolation,time)+args
+
     def getProfile(self,time,level=0):
         """Get a profile.
 
         time: time slice
-        level: horizontal slice."""
+        level: horizontal slice.
+
+        the field is sampled along the profile using interpolation weights which are
+        computed once for the profile, see CFloadprofile.getsampler. Profiles are cached
+        by the profile file, the returned array is read-only."""
 
-        #if time not in self.__data:
-        #    self.__data[time] = {}
-        #if level not in self.__data[time]:
-        #    var = self.getGMTgrid(time,level=level)
-        #    self.__data[time][level] = var.grdtrack(self.cffile.interpolated[0,:],self.cffile.interpolated[1,:])
+        if (time >= self.cffile.numt):
+            raise ValueError, 'ISM file does not contain time slice %d' % time
+        key = self.__cachekey('profile',time,level)
+        data = self.cffile.profilecache.get(key)
+        if data is None:
+            sampler = self.cffile.getsampler(self,self.interpolation)
+            data = self.cffile.profilecache.put(key,sampler.eval(self.get2Dfield(time,level=level)))
+        return data
 
-        #return self.__data[time][level]
-        var = self.getGMTgrid(time,level=level)
-        return var.grdtrack(self.cffile.interpolated[0,:],self.cffile.interpolated[1,:])
+    def getProfiles(self,time):
+        """Get profiles of all levels of a 3D variable.
+
+        time: time slice
+
+        returns an array [level,distance]"""
+
+        if (time >= self.cffile.numt):
+            raise ValueError, 'ISM file does not contain time slice %d' % time
+        sampler = self.cffile.getsampler(self,self.interpolation)
+        return sampler.eval(self.get3Dfield(time))
+
+    def getHeightProfiles(self,time,heights):
+        """Get profiles at heights above the ice base.
+
+        time: time slice
+        heights: list/array of heights above the ice base
+
+        returns an array [height,distance], NaN where a height is outside the ice.
+
+        the data is interpolated linearly between the sigma levels bracketing each
+        height, all heights and positions along the profile are processed at once."""
+
+        if 'level' not in self.var.dimensions:
+            raise ValueError, 'Not a 3D variable'
+
+        h = numpy.asarray(heights,'d')[:,numpy.newaxis]
+        data = self.getProfiles(time)
+        thick = numpy.asarray(self.cffile.getprofile('thk').getProfile(time),'d')[numpy.newaxis,:]
+        sigma = numpy.asarray(self.file.variables['level'][:],'d')
+        ice = thick>0.
+        s = numpy.where(ice,1.-h/numpy.where(ice,thick,1.),1.)
+        column = numpy.arange(thick.shape[1])[numpy.newaxis,:]
+        values = calc_sigma_interpolate(sigma,data,column,s)
+        return numpy.where(numpy.logical_or(h<0.,h>thick),numpy.nan,values)
 
     def getProfile2D_litho(self,time):
         """Get a 2D profile which is not in sigma coordsystem.
@@ -228,31 +460,57 @@ class CFprofvar(CFvariable):
         if 'lithoz' not in self.var.dimensions:
             raise ValueError, 'Not a 3D variable'
 
+        return self.__litho_grid(self.getProfiles(time))
 
-        ymin = self.file.variables['lithoz'][-1]
-        ymax = self.file.variables['lithoz'][0]
-        yres = 50.
-        y = self.file.variables['lithoz'][:].tolist()
-        y.reverse()
+    def getProfiles2D_litho(self,time=None,step=1):
+        """Iterate over 2D profiles which are not in sigma coordsystem.
+
+        i.e. litho temperature, e.g. for animations.
+
+        time: if None, return data for all time slices
+              if list/etc of size two, interpret as array selection
+        step: only use every step time slice
+
+        yields a GMT grid for each time slice. The time slices are read in chunks of
+        cffile.blocksize slices and each chunk is sampled along the profile at once."""
 
-        # load data
-        data = numpy.zeros([len(self.file.variables['lithoz']), len(self.cffile.xvalues)], 'f')
-        for i in range(0,len(self.file.variables['lithoz'])):
-            prof = self.getProfile(time,level=len(self.file.variables['lithoz'])-i-1)
-            data[i,:] = prof
+        if 'lithoz' not in self.var.dimensions:
+            raise ValueError, 'Not a 3D variable'
+
+        (tarray,t) = CFchecklist(time,self.cffile.timeaxis)
+        if not tarray:
+            t = [t,t]
+        sampler = self.cffile.getsampler(self,self.interpolation)
+        chunk = self.cffile.blocksize*step
+        for t0 in range(t[0],t[1]+1,chunk):
+            t1 = min(t0+chunk-1,t[1])
+            data = sampler.eval(self.get3Dfields([t0,t1],step=step))
+            for i in range(len(data)):
+                yield self.__litho_grid(data[i])
+
+    def __litho_grid(self,data):
+        """Interpolate lithosphere profiles onto depth bins.
+
+        data: array [level,distance]
+
+        returns a GMT grid"""
+
+        lithoz = numpy.asarray(self.file.variables['lithoz'][:],'d')
+        ymin = lithoz[-1]
+        ymax = lithoz[0]
+        yres = 50.
 
         # setup output grid
         grid = Grid()
         grid.x_minmax = [0,self.cffile.xvalues[-1]]
         grid.y_minmax = [ymin,ymax]
         numy=int((ymax-ymin)/yres)+1
-        grid.data = numpy.zeros([len(self.cffile.xvalues),numy], 'f')
 
-        # interpolate
+        # interpolate all columns at once, levels are ordered by increasing depth
         pos = (numpy.arange(numy)-numy+1)*yres
-        for j in range(0,len(self.cffile.xvalues)):
-            interpolated = CFinterpolate_linear(y,data[:,j],pos)
-            grid.data[j,:] = interpolated
+        column = numpy.arange(len(self.cffile.xvalues))
+        grid.data = calc_sigma_interpolate(lithoz[::-1],data[::-1,:],column[:,numpy.newaxis],
+                                           pos[numpy.newaxis,:]).astype('f')
 
         return grid
 
@@ -261,68 +519,160 @@ class CFprofvar(CFvariable):
 
         time: time slice
 
-        returns a GMT grid"""
+        returns a GMT grid, its data is cached by the profile file and read-only."""
 
         if 'level' not in self.var.dimensions:
             raise ValueError, 'Not a 3D variable'
 
-        if time not in self.__data2d:
-            # load ice thickness and bedrock profiles
-            ihprof = numpy.array(CFprofvar(self.cffile,'thk').getProfile(time))
-            try:
-                rhprof = numpy.array(CFprofvar(self.cffile,'topg').getProfile(time))
-            except:
-                rhprof = numpy.zeros(len(ihprof))
-            ymin=min(rhprof)
-            ymax=max(rhprof+ihprof)
-            numy=int((ymax-ymin)/self.yres)+1
-
-            # load data
-            data = numpy.zeros([len(self.file.variables['level']), len(self.cffile.xvalues)], 'f')
-            for i in range(0,len(self.file.variables['level'])):
-                prof = self.getProfile(time,level=len(self.file.variables['level'])-i-1)
-                data[i,:] = prof
-
-            # setup output grid
-            grid = Grid()
-            grid.x_minmax = [0,self.cffile.xvalues[-1]]
-            grid.y_minmax = [ymin,ymax]
+        # load ice thickness and bedrock profiles
+        ihprof = numpy.array(self.cffile.getprofile('thk').getProfile(time))
+        try:
+            rhprof = numpy.array(self.cffile.getprofile('topg').getProfile(time))
+        except:
+            rhprof = numpy.zeros(len(ihprof))
+        ymin=min(rhprof)
+        ymax=max(rhprof+ihprof)
+        numy=int((ymax-ymin)/self.yres)+1
+
+        # setup output grid
+        grid = Grid()
+        grid.x_minmax = [0,self.cffile.xvalues[-1]]
+        grid.y_minmax = [ymin,ymax]
+
+        key = self.__cachekey('profile2d',time,self.yres)
+        grid.data = self.cffile.profilecache.get(key)
+        if grid.data is None:
+            # load data, levels are ordered from the bed upwards
+            data = self.getProfiles(time)[::-1,:]
+            sigma = numpy.asarray(self.file.variables['level'][:],'d')
+
             grid.data = numpy.zeros([len(self.cffile.xvalues),numy], 'f')
             grid.data[:,:] = -100000000.
-            # interpolate
+            # interpolate all ice covered bins at once
             rhprof = rhprof-ymin
-            for j in range(0,len(self.cffile.xvalues)):
-                if ihprof[j]>0.:
-                    start = int(rhprof[j]/self.yres)
-                    end   = int((rhprof[j]+ihprof[j])/self.yres)+1
-                    pos = numpy.arange(start*self.yres,end*self.yres,self.yres)
-                    interpolated = CFinterpolate_linear(rhprof[j]+ihprof[j]*self.file.variables['level'][:],
-                                                        data[:,j],
-                                                        pos)
-                    grid.data[j,start:end] = interpolated
-            #self.__data2d[time] = grid
-            return grid
-        #return self.__data2d[time]
+            ice = ihprof>0.
+            start = numpy.where(ice,(rhprof/self.yres).astype(int),numy)
+            end = numpy.where(ice,((rhprof+ihprof)/self.yres).astype(int)+1,0)
+            bins = numpy.arange(numy)
+            (j,k) = numpy.nonzero(numpy.logical_and(bins[numpy.newaxis,:]>=start[:,numpy.newaxis],
+                                                    bins[numpy.newaxis,:]<end[:,numpy.newaxis]))
+            s = (k*self.yres-rhprof[j])/ihprof[j]
+            grid.data[j,k] = calc_sigma_interpolate(sigma,data,j,s)
+            grid.data = self.cffile.profilecache.put(key,grid.data)
+        return grid
 
-    def getProfileTS(self,time=None,level=0):
+    def getProfileTS(self,time=None,level=0,step=1):
         """Get a time-distance data.
 
         
         time: if None, return data for all time slices
               if list/etc of size two, interpret as array selection
               if single value, get only this time slice
-        level: horizontal slice."""
+        level: horizontal slice.
+        step: only use every step time slice
 
-        (tarray,t) = CFchecklist(time,self.file.variables['time'])
+        the time slices are read in chunks of cffile.blocksize slices and each chunk is
+        sampled along the profile at once. The data is cached by the profile file, the
+        returned data is read-only."""
+
+        (tarray,t) = CFchecklist(time,self.cffile.timeaxis)
 
         if tarray:
-            data = []
-            for i in range(t[0],t[1]+1):
-                data.append(self.getProfile(i,level=level))
             grid = PyGMT.Grid()
             grid.x_minmax = [0,self.cffile.xvalues[-1]]
-            grid.y_minmax = [self.cffile.time(t[0]),self.cffile.time(t[1])]
-            grid.data = numpy.transpose(numpy.array(data))
+            grid.y_minmax = [self.cffile.time(t[0]),self.cffile.time(t[0]+((t[1]-t[0])//step)*step)]
+            key = self.__cachekey('profilets',t[0],t[1],level,step)
+            grid.data = self.cffile.profilecache.get(key)
+            if grid.data is None:
+                sampler = self.cffile.getsampler(self,self.interpolation)
+                chunk = self.cffile.blocksize*step
+                data = []
+                for t0 in range(t[0],t[1]+1,chunk):
+                    t1 = min(t0+chunk-1,t[1])
+                    data.append(sampler.eval(self.get2Dfields([t0,t1],level=level,step=step)))
+                grid.data = self.cffile.profilecache.put(key,numpy.transpose(numpy.concatenate(data)))
             return grid
         else:
             return self.getProfile(t,level=level)
+
+def calc_sigma_interpolate(sigma,data,column,s):
+    """Linearly interpolate columns of data given on sigma levels.
+
+    sigma: monotonically increasing sigma levels (or any other vertical coordinate)
+    data: array [level,column]
+    column: column of each point to be interpolated
+    s: sigma coordinate of each point, data is extended beyond the first/last level
+
+    returns an array of interpolated values"""
+
+    s = numpy.asarray(s,'d')
+    column = numpy.asarray(column)
+    k = numpy.clip(numpy.searchsorted(sigma,s),1,len(sigma)-1)
+    f = numpy.clip((s-sigma[k-1])/(sigma[k]-sigma[k-1]),0.,1.)
+    return data[k-1,column] + f*(data[k,column]-data[k-1,column])
+
+def CFgetExtents(cffile,profiles,time=None,interval=1,subsample=False,method='bicubic'):
+    """Get ice extent along a number of profiles.
+
+    cffile: CF file
+    profiles: list of CFprofile
+    time: if None, return data for all time slices
+          if list/etc of size two, interpret as array selection
+          if single value, get only this time slice
+    interval: extract every interval timeslice
+    subsample: estimate position of margin between samples, see calc_extent
+    method: interpolation method used for sampling ice thickness
+
+    returns an array [profile,time] or [profile] if time is a single value.
+
+    ice thicknesses are read in blocks of cffile.blocksize time slices which are
+    sampled along all profiles, see calc_extent."""
+
+    (tarray,t) = CFchecklist(time,cffile.timeaxis)
+    if not tarray:
+        t = [t,t]
+    thk = cffile.getvar('thk')
+    samplers = [p.getsampler(thk,method) for p in profiles]
+    chunk = cffile.blocksize*interval
+    values = [[] for p in profiles]
+    for t0 in range(t[0],t[1]+1,chunk):
+        t1 = min(t0+chunk-1,t[1])
+        data = thk.get2Dfields([t0,t1],step=interval)
+        for i in range(len(profiles)):
+            values[i].append(calc_extent(samplers[i].eval(data),profiles[i].xvalues,subsample=subsample))
+    values = numpy.array([numpy.concatenate(v) for v in values])
+    if not tarray:
+        return values[:,0]
+    return values
+
+def calc_extent(thk,xvalues,subsample=False):
+    """Find ice margin along profiles.
+
+    thk: array [time,distance] of ice thicknesses along profile
+    xvalues: distance along profile
+    subsample: estimate position of margin between samples
+
+    the margin is the last ice covered sample along the profile. If there is no ice
+    the first position is returned. When subsample is set the ice thickness is
+    extrapolated linearly from the last two ice covered samples and the margin is
+    moved to where it vanishes, but not beyond the next (ice free) sample. The margin
+    stays at the last ice covered sample if the ice does not thin towards it."""
+
+    thk = numpy.asarray(thk,'d')
+    xvalues = numpy.asarray(xvalues,'d')
+    n = thk.shape[1]
+    ice = numpy.logical_and(thk>0.,thk<1.e10)
+    last = n-1-numpy.argmax(ice[:,::-1],axis=1)
+    last = numpy.where(ice.any(axis=1),last,0)
+    extent = xvalues[last]
+    if subsample and n > 2:
+        rows = numpy.arange(thk.shape[0])
+        nxt = numpy.minimum(last+1,n-1)
+        prev = numpy.maximum(last-1,0)
+        (h0,hp) = (thk[rows,last],thk[rows,prev])
+        margin = numpy.logical_and(numpy.logical_and(nxt>last,prev<last),
+                                   numpy.logical_and(ice[rows,last],ice[rows,prev]))
+        margin = numpy.logical_and(margin,hp>h0)
+        dist = numpy.where(margin,h0*(xvalues[last]-xvalues[prev])/numpy.where(margin,hp-h0,1.),0.)
+        extent = extent + numpy.clip(dist,0.,xvalues[nxt]-xvalues[last])
+    return extent
@@ -65,7 +65,7 @@ class CFRSLArea(PyGMT.AutoXY):
 
         t = [cffile.timeslice(self.time[0],round='d'),
              cffile.timeslice(self.time[1],round='u')]
-        times = cffile.file.variables['time'][t[0]:t[1]+1]*self.timescale
+        times = cffile.time(t)
         data = cffile.getRSL([self.location[3],self.location[4]],t,clip=clip)
         self.line(pen,times,data)
 
@@ -76,11 +76,14 @@ class CFRSLArea(PyGMT.AutoXY):
         expandy: when set to True expand region to sensible value.
         """
 
-        data = self.rsl.getRSLobs(self.lid)
-        for obs in data:
+        store = self.rsl.store
+        s = store.slice(self.lid)
+        if s.stop > s.start:
+            time = (store.time[s]*self.timescale).tolist()
+            rsl = store.rsl[s].tolist()
             if self.errors:
-                self.point([obs[2]*self.timescale],[obs[3]],[obs[5]*self.timescale],[obs[7]])
-            self.plotsymbol([obs[2]*self.timescale],[obs[3]],size=self.symbolsize)
+                self.point(time,rsl,(store.time_m[s]*self.timescale).tolist(),store.rsl_m[s].tolist())
+            self.plotsymbol(time,rsl,size=self.symbolsize)
 
         self.ll[0] = self.time[0]
         self.ur[0] = self.time[1]
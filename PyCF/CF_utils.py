@@ -57,37 +57,21 @@ def CFgetstats(cffile,time, eismint=False):
     return stats
 
 def CFinterpolate_xy(profile,interval):
-    "linearly interpolate profile, return interpolated array and number of points outside region"
-
-    data = []
-    p = numpy.array(profile)
-    for i in range(0,len(p[0,:])):
-        data.append([float(p[0,i]),float(p[1,i])])
-    remainder = lr = 0.
-    d0 = data[0]
-    ix = []
-    iy = []
-    ix.append(d0[0])
-    iy.append(d0[1])
-
-    for d in data[1:]:
-        x = d[0] - d0[0]
-        y = d[1] - d0[1]
-        dist = math.sqrt(x*x + y*y)
-        remainder = remainder + dist
-        cm = x/dist
-        sm = y/dist
-        while (remainder - interval) >= 0.:
-            d0[0] = d0[0] + (interval-lr)*cm
-            d0[1] = d0[1] + (interval-lr)*sm
-            lr = 0.
-            ix.append(d0[0])
-            iy.append(d0[1])
-            remainder = remainder - interval
-        lr = remainder
-        d0 = d    
-    
-    return numpy.array([ix,iy],'f')
+    """linearly interpolate profile.
+
+    profile: array [2,n] of control points
+    interval: distance between interpolated points along profile
+
+    returns an array [2,m] of points spaced interval apart along the polyline, starting
+    at the first control point."""
+
+    p = numpy.asarray(profile,'d')
+    # cumulative arc length of control points
+    dist = numpy.sqrt(numpy.sum((p[:,1:]-p[:,:-1])**2,axis=0))
+    arclen = numpy.concatenate(([0.],numpy.cumsum(dist)))
+    num = int(math.floor(arclen[-1]/interval*(1.+1.e-12)))+1
+    pos = numpy.arange(num)*interval
+    return numpy.array([numpy.interp(pos,arclen,p[0,:]),numpy.interp(pos,arclen,p[1,:])],'f')
 
 def CFinterpolate_linear(x,y,pos):
     """Linear interpolation.
@@ -1,9 +1,13 @@
 from proj import *
 from TwoDspline import *
 from CF_proj import *
+from CF_netcdf import *
+from CF_cache import *
+from CF_interpolate import *
 from CF_createfile import *
 from CF_loadfile import *
 from CF_IOmisc import *
+from CF_output import *
 from CF_colourmap import *
 from CF_options import *
 from CF_area import *
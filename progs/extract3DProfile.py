@@ -27,58 +27,45 @@ parser = PyCF.CFOptParser()
 parser.add_option("-H",type="float",dest="hlevel",action='append',help="extract data from this ice level in metres above 0")
 parser.profile()
 parser.time()
+parser.output()
 opts = PyCF.CFOptions(parser,2)
 infile = opts.cfprofile()
-time = opts.times(infile,0)
 profile = opts.profs(infile)
 if not profile.is3d:
     print 'Selected variable %s is not 3D'%profile.name
     sys.exit(1)
 
-# extract data
 hlevel = opts.options.hlevel
 level = profile.file.variables['level']
-data = []
-for l in range(0,len(level)):
-    data.append(profile.getProfile(time,level=l))
-thick = infile.getprofile('thk').getProfile(time)
-
 
 # writing data to file
-outfile = open(opts.args[-1],'w')
-outfile.write('# file:\t\t%s\n# title:\t%s\n# time:\t\t%f\n'%(opts.args[-2],infile.title,infile.time(time)))
-
+outfile = opts.output(record='distance')
+outfile.attribute('source',opts.args[-2])
+outfile.text('# file:\t\t%s\n# title:\t%s\n'%(opts.args[-2],infile.title))
 if hlevel==None:
-    outfile.write('#levels:\t\t')
-    for l in range(0,len(level)):
-        outfile.write('\t%f'%level[l])
-    outfile.write('\n')
-    outfile.write('#x\t\tthick\n')
-    for i in range(0,len(infile.xvalues)):
-        outfile.write('%f\t%f'%(infile.xvalues[i],thick[i]))
-        for l in range(0,len(level)):
-            outfile.write('\t%f'%data[l][i])
-        outfile.write('\n')
+    outfile.coord('level',level[:],long_name='sigma level')
+    dims = ('level',)
 else:
-    outfile.write('#ice_layer:\t\t')
-    for l in range(0,len(hlevel)):
-        outfile.write('\t%f'%hlevel[l])
-    outfile.write('\n')
-    outfile.write('#x\t\tthick\n')
-    for i in range(0,len(infile.xvalues)):
-        outfile.write('%f\t%f'%(infile.xvalues[i],thick[i]))
-        for l in range(0,len(hlevel)):
-            if hlevel[l]<0. or hlevel[l]>thick[i]:
-                hdata = 'NaN'
-            elif hlevel[l]==0.:
-                hdata = '%f'%data[-1][i]
-            else:
-                for lev in range(len(level)-1,0,-1):
-                    if hlevel[l]<(1.-level[lev])*thick[i]:
-                        break
-                hdata = '%f'%(data[lev+1][i]+hlevel[l]/thick[i]*(data[lev][i]-data[lev+1][i])/(level[lev+1]-level[lev]))
-            outfile.write('\t%s'%hdata)
-        outfile.write('\n')
-                
-        
+    outfile.coord('height',hlevel,units='meter',long_name='height above base of ice')
+    dims = ('height',)
+outfile.field('time',units='year',long_name='time',text=False)
+outfile.field('x',units='km',long_name='distance along profile')
+outfile.field('thick',units='meter',long_name='ice thickness')
+outfile.field(profile.name,dims,units=profile.units,long_name=profile.long_name)
+for i in range(0,opts.ntimes):
+    time = opts.times(infile,i)
+    outfile.text('# time:\t\t%f\n'%infile.time(time))
+
+    # extract data
+    thick = infile.getprofile('thk').getProfile(time)
+    if hlevel==None:
+        data = profile.getProfiles(time)
+        outfile.text('#levels:\t\t'+''.join(['\t%f'%l for l in level[:]])+'\n')
+    else:
+        data = profile.getHeightProfiles(time,hlevel)
+        outfile.text('#ice_layer:\t\t'+''.join(['\t%f'%l for l in hlevel])+'\n')
+    outfile.text('#x\t\tthick\n')
+    outfile.write(**{'time' : infile.time(time), 'x' : infile.xvalues, 'thick' : thick,
+                     profile.name : numpy.transpose(data)})
+
 outfile.close()
@@ -26,34 +26,31 @@ import PyGMT,PyCF,numpy,sys
 parser = PyCF.CFOptParser()
 parser.profile()
 parser.time()
+parser.output()
 opts = PyCF.CFOptions(parser,2)
 infile = opts.cfprofile()
 time = opts.times(infile,0)
 
-# extracting data
-data = []
-vars = []
+# writing data to file
+outfile = opts.output(record='distance')
+outfile.attribute('source',opts.args[-2])
+outfile.attribute('time',infile.time(time))
+outfile.text('# file:\t\t%s\n# title:\t%s\n# time:\t\t%f\n'%(opts.args[-2],infile.title,infile.time(time)))
 
-data.append(infile.xvalues)
-vars.append('# dist')
+# extracting data
+data = {'distance' : infile.xvalues}
+vars = ['# dist']
+outfile.field('distance',units='km',long_name='distance along profile')
 for i in range(0,opts.nvars):
     profile = opts.profs(infile,i)
     if profile.average:
-        vars.append('%s_avg'%profile.name)
+        name = '%s_avg'%profile.name
     else:
-        vars.append(profile.name)
-    data.append(profile.getProfile(time,level=opts.options.level))
-
-# writing data to file
-outfile = open(opts.args[-1],'w')
-outfile.write('# file:\t\t%s\n# title:\t%s\n# time:\t\t%f\n'%(opts.args[-2],infile.title,infile.time(time)))
-for v in vars:
-    outfile.write('%s\t\t'%v)
-outfile.write('\n')
-for x in range(0,len(infile.xvalues)):
-    for d in data:
-        outfile.write('%f\t'%d[x])
-    outfile.write('\n')
-
+        name = profile.name
+    vars.append(name)
+    data[name] = profile.getProfile(time,level=opts.options.level)
+    outfile.field(name,units=profile.units,long_name=profile.long_name)
+outfile.text('\t\t'.join(vars)+'\t\t\n')
+outfile.write(**data)
 
 outfile.close()
@@ -26,6 +26,7 @@ import PyGMT,PyCF,numpy,sys
 parser = PyCF.CFOptParser()
 parser.profile()
 parser.timeint()
+parser.output()
 opts = PyCF.CFOptions(parser,2)
 infile = opts.cfprofile()
 time = opts.times(infile,0)
@@ -41,20 +42,20 @@ if opts.nvars>1:
     print 'Warning, more than one variable requested, only processing first one.'
 
 
-outfile = open(opts.args[-1],'w')
-outfile.write('# file:\t\t%s\n# title:\t%s\n# variable:\t\t%s\n'%(opts.args[-2],infile.title,opts.options.vars[0]))
+outfile = opts.output(sep=', ')
+outfile.attribute('source',opts.args[-2])
+outfile.text('# file:\t\t%s\n# title:\t%s\n# variable:\t\t%s\n'%(opts.args[-2],infile.title,opts.options.vars[0]))
 # write distances along profile
-outfile.write('     ')
-for x in range(0,len(infile.xvalues)):
-    outfile.write(', %f'%infile.xvalues[x])
-outfile.write('\n')
+outfile.text('     '+''.join([', %f'%x for x in infile.xvalues])+'\n')
 
 profile = opts.profs(infile)
-for t in range(t0,t1):
-    data = profile.getProfile(t,level=opts.options.level)
-    outfile.write('%f'%infile.time(t))
-    for x in range(0,len(infile.xvalues)):
-        outfile.write(', %f'%data[x])
-    outfile.write('\n')
+outfile.coord('distance',infile.xvalues,units='km',long_name='distance along profile')
+outfile.field('time',units='year',long_name='time')
+outfile.field(profile.name,('distance',),units=profile.units,long_name=profile.long_name)
+# extract data in chunks of time slices, each chunk is written straight away
+for c0 in range(t0,t1,infile.blocksize):
+    c1 = min(c0+infile.blocksize,t1)-1
+    data = profile.getProfileTS([c0,c1],level=opts.options.level)
+    outfile.write(**{'time' : infile.time([c0,c1]), profile.name : numpy.transpose(data.data)})
 
 outfile.close()
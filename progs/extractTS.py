@@ -20,7 +20,7 @@
 
 """Extract time series from netCDF file"""
 
-import PyCF,sys
+import PyCF,numpy,sys
 
 # creating option parser
 parser = PyCF.CFOptParser()
@@ -31,6 +31,7 @@ parser.add_option("--melt",default=False,action="store_true",help="extract melt
 parser.add_option("--extent",default=False,action="store_true",help="extract ice extent along profile")
 parser.profile_file()
 #parser.time()
+parser.output()
 opts = PyCF.CFOptions(parser,2)
 
 if opts.options.extent:
@@ -42,47 +43,48 @@ if opts.options.extent:
 else:
     infile = opts.cffile()
 
-outfile = open(opts.args[-1],'w')
+outfile = opts.output()
+outfile.attribute('source',opts.args[-2])
 # write header
-outfile.write('# file:\t\t%s\n# title:\t%s\n# comment:\t%s\n'%(opts.args[-2],infile.title,infile.comment))
+outfile.text('# file:\t\t%s\n# title:\t%s\n# comment:\t%s\n'%(opts.args[-2],infile.title,infile.comment))
 headers = '#time'
 time = infile.time(None)
+data = {'time' : time}
+fields = [('time',(),'','time')]
 if opts.options.volume:
     headers+='\tvolume'
-    volume = infile.getIceVolume()
+    data['volume'] = infile.getIceVolume()
+    fields.append(('volume',(),'','ice volume'))
 if opts.options.area:
     headers+='\tarea'
-    area = infile.getIceArea()
+    data['area'] = infile.getIceArea()
+    fields.append(('area',(),'','area covered by ice'))
 if opts.options.melt:
     headers+='\tmelt_f'
-    melt = infile.getFracMelt()
+    data['melt_f'] = infile.getFracMelt()
+    fields.append(('melt_f',(),'','melt fraction area'))
 if opts.options.extent:
     headers+='\textent'
-    extent = infile.getExtent()
+    data['extent'] = infile.getExtent()
+    fields.append(('extent',(),'','ice extent along profile'))
 if opts.options.vars != None:
-    variables = []
+    outfile.coord('node_i',[ij[0] for ij in opts.options.ij],dim='node',long_name='node index along x')
+    outfile.coord('node_j',[ij[1] for ij in opts.options.ij],dim='node',long_name='node index along y')
     for i in range(0,opts.nvars):
         var = opts.vars(infile,i)
-        headers+='\t%s'%var.name
-        variables.append(var.getSpotIJ(opts.options.ij[0],level=opts.options.level))
+        if len(opts.options.ij) > 1:
+            for ij in opts.options.ij:
+                headers+='\t%s(%d,%d)'%(var.name,ij[0],ij[1])
+        else:
+            headers+='\t%s'%var.name
+        data[var.name] = numpy.transpose(var.getSpotsIJ(opts.options.ij,level=opts.options.level))
+        fields.append((var.name,('node',),var.units,var.long_name))
 headers+='\n'
-outfile.write(headers)
+outfile.text(headers)
+for (name,dims,units,long_name) in fields:
+    outfile.field(name,dims,units=units,long_name=long_name)
 
-for t in range(0,len(time)):
-    data = '%f'%time[t]
-    if opts.options.volume:
-        data+='\t%f'%volume[t]
-    if opts.options.area:
-        data+='\t%f'%area[t]
-    if opts.options.melt:
-        data+='\t%f'%melt[t]
-    if opts.options.extent:
-        data+='\t%f'%extent[t]
-    if opts.options.vars != None:
-        for i in range(0,len(variables)):
-            data+='\t%f'%variables[i][t]
-    data+='\n'
-    outfile.write(data)
+outfile.write(**data)
 
 outfile.close()
 infile.close()
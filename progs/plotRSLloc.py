@@ -41,14 +41,13 @@ data = []
 id_dx = 3.75
 id_dy = 0.25
 if opts.options.print_ids:
-    rsldata = rsl.getLocationRange(infile.minmax_long,infile.minmax_lat)
+    (rows,xy) = infile.getRSLlocations(rsl)
     
     idysize=opts.papersize[1]-14.
     idarea = PyGMT.AreaXY(bigarea,size=[opts.papersize[0],idysize],pos=[-2.,0.])
-    for i in range(0,len(rsldata)):
-        loc = rsldata[i]
-        if infile.inside(infile.project([loc[3],loc[4]])):
-            data.append("%d: (%.2fE %.2fN) %d"%(loc[0],loc[3],loc[4],loc[5]))
+    for i in rows:
+        loc = rsl.store.location(i)
+        data.append("%d: (%.2fE %.2fN) %d"%(loc[0],loc[3],loc[4],loc[5]))
 
     ysize=(len(data)/5+1)*id_dy
     for i in range(0,len(data)):
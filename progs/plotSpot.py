@@ -88,6 +88,7 @@ for f in range(0,opts.nfiles):
             ldata = infile.file.variables['lithoz']
             lname = infile.file.variables['lithoz'].long_name
 
+    spots = var.getSpotsIJ(opts.options.ij,time,level)
     i = 0
     colour=0
     for ij in opts.options.ij:
@@ -98,7 +99,7 @@ for f in range(0,opts.nfiles):
             colour = i
         elif mfiles:
             colour = f
-        data = var.getSpotIJ(ij,time,level)
+        data = spots[i]
         if dotimes:
             area.line('-W1/%s'%PyCF.CFcolours[colour],infile.time(time),data)
         elif dolevels:
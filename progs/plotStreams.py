@@ -22,6 +22,14 @@
 
 import PyGMT,PyCF,sys, numpy, tempfile
 
+def stream_field(cffile,t,name,velocity):
+    """Get basal velocities or where ice is sliding for time slice t."""
+
+    vgrid = cffile.getvar(name).get2Dfield(t)
+    if velocity:
+        return vgrid
+    return numpy.where(vgrid>0., 1.,0.).astype('f')
+
 # creating option parser
 deltat = 1000.
 parser = PyCF.CFOptParser()
@@ -29,6 +37,7 @@ parser.profile_file()
 parser.time()
 parser.add_option("--deltat",default=deltat,type="float",help="set integration interval (default %sa)"%deltat)
 parser.add_option("--velocity",default=False,action="store_true",help="plot basal velocities integrated over time interval")
+parser.add_option("--workers",default=1,type="int",help="number of processes used for integrating over time interval (default 1)")
 parser.var_options()
 parser.region()
 parser.plot()
@@ -100,16 +109,9 @@ for i in range(0,numplots):
     except:
         bvel = infile.getvar('bvel')
     
-    data = numpy.zeros((len(bvel.xdim), len(bvel.ydim)),'f')
-
-    # loop over time slices
-    for t in range(time_start,time_end+1):
-        vgrid = bvel.get2Dfield(t)
-
-        if opts.options.velocity:
-            data = data + vgrid
-        else:
-            data = data + numpy.where(vgrid>0., 1,0)
+    # sum over time slices
+    data = infile.map_slices(stream_field,[time_start,time_end],workers=opts.options.workers,
+                             combine=numpy.add,args=(bvel.name,opts.options.velocity))
     streams = bvel.getGMTgrid(time)
     streams.data = data/(time_end+1-time_start)
     